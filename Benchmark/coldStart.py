@@ -0,0 +1,133 @@
+import argparse, contextlib, importlib, io, json, os, subprocess, sys, time
+from typing import Optional, Dict, Any, List
+
+# Cold start cost of each handler under different init configurations. Every trial runs in a fresh
+# interpreter, so imports, client construction and the first request all start from nothing.
+#
+#   Init       importing the handler module, i.e. Lambda's init phase
+#   FirstUse   building the clients the first request needs that init did not build
+#   Request    the rest of the first request, run against the local stand-ins
+#
+# On demand the first request waits for all three. With provisioned concurrency or SnapStart init has
+# already run, so only FirstUse and Request are on the request path
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+TEMPLATES_DIR = os.path.join(REPO_DIR, 'Templates')
+
+HANDLERS = ['RekognitionLambdaFunction', 'EmailLambdaFunction']
+
+CONFIGURATIONS = {
+    'lazy': {},
+    'prewarm': {'PREWARM_CLIENTS': 'true'},
+    'lazy-resize': {'IMAGE_MAX_DIMENSION': '1600'},
+    'prewarm-resize': {'PREWARM_CLIENTS': 'true', 'IMAGE_MAX_DIMENSION': '1600'}
+}
+
+BASE_ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'DYNAMODB_TABLE': 'local-results',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:local:000000000000:alerts',
+    'SOURCE_IMAGE': 'images/groupphoto.png'
+}
+
+def first_request(handler_name: str, module) -> float:
+    # The stand-ins are only imported now, so their own imports are not counted as init
+    sys.path.insert(0, BENCHMARK_DIR)
+    import localPipeline, LambdaClients
+
+    if handler_name == 'RekognitionLambdaFunction':
+        queue = localPipeline.FakeQueue()
+        s3 = localPipeline.FakeS3(queue)
+        dynamodb = localPipeline.FakeDynamoResource()
+        LambdaClients.override('client', 's3', s3)
+        LambdaClients.override('client', 'rekognition', localPipeline.FakeRekognition(s3, latency=0))
+        LambdaClients.override('resource', 'dynamodb', dynamodb)
+
+        s3.objects[('local-bucket', os.environ['SOURCE_IMAGE'])] = os.urandom(32 * 1024)
+        s3.put_object(Bucket='local-bucket', Key='cold/image0.jpg', Body=os.urandom(32 * 1024))
+        records = [message for _, message in queue.receive(1, 0)]
+    else:
+        LambdaClients.override('client', 'sns', localPipeline.FakeSNS())
+        records = [{'eventName': 'INSERT', 'dynamodb': {'NewImage': {
+            'id': {'S': 'cold/image0.jpg'},
+            'backgroundBrightness': {'N': '1'},
+            'highestSimilarity': {'N': '1'}
+        }}}]
+
+    start = time.perf_counter()
+    module.lambda_handler({'Records': records}, None)
+    return time.perf_counter() - start
+
+def measure_trial(handler_name: str) -> Dict[str, float]:
+    # Runs inside the fresh interpreter
+    sys.path.insert(0, TEMPLATES_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        module = importlib.import_module(handler_name)
+        init = time.perf_counter() - start
+
+        import LambdaClients
+        start = time.perf_counter()
+        LambdaClients.warm(module.WARM_CLIENTS, module.WARM_TABLES)
+        first_use = time.perf_counter() - start
+
+        request = first_request(handler_name, module)
+    return {'Init': init, 'FirstUse': first_use, 'Request': request}
+
+def run_trial(handler_name: str, configuration: Dict[str, str]) -> Dict[str, float]:
+    environment = dict(os.environ, **BASE_ENVIRONMENT, **configuration)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--trial', handler_name],
+        env=environment, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_benchmark(trials: int = 10, handlers: Optional[List[str]] = None, configurations: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    # Not imported at the top, a trial must not have boto3 loaded before it starts measuring
+    from localPipeline import percentile
+    results = []
+    for handler_name in handlers or HANDLERS:
+        for name in configurations or list(CONFIGURATIONS):
+            samples = [run_trial(handler_name, CONFIGURATIONS[name]) for _ in range(trials)]
+            on_demand = [s['Init'] + s['FirstUse'] + s['Request'] for s in samples]
+            initialised = [s['FirstUse'] + s['Request'] for s in samples]
+            result = {'Handler': handler_name, 'Configuration': name, 'Trials': trials}
+            for stage in ['Init', 'FirstUse', 'Request']:
+                result[f"{stage}P50"] = percentile([s[stage] for s in samples], 50)
+            result['OnDemandP50'] = percentile(on_demand, 50)
+            result['OnDemandP99'] = percentile(on_demand, 99)
+            result['InitialisedP50'] = percentile(initialised, 50)
+            result['InitialisedP99'] = percentile(initialised, 99)
+            results.append(result)
+    return results
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    print(f"{'handler':<28}{'configuration':<16}{'init':>8}{'first use':>11}{'request':>9}"
+          f"{'on demand p50/p99':>20}{'initialised p50/p99':>22}  (ms)")
+    for r in results:
+        print(f"{r['Handler']:<28}{r['Configuration']:<16}{r['InitP50'] * 1000:>8.1f}{r['FirstUseP50'] * 1000:>11.1f}{r['RequestP50'] * 1000:>9.1f}"
+              f"{r['OnDemandP50'] * 1000:>11.1f} /{r['OnDemandP99'] * 1000:>7.1f}{r['InitialisedP50'] * 1000:>13.1f} /{r['InitialisedP99'] * 1000:>7.1f}")
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Compare handler cold start time across init configurations")
+    parser.add_argument('--trials', type=int, default=10, help="Fresh interpreters per handler and configuration")
+    parser.add_argument('--handler', action='append', choices=HANDLERS, help="Only measure this handler, may be repeated")
+    parser.add_argument('--configuration', action='append', choices=list(CONFIGURATIONS), help="Only measure this configuration, may be repeated")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    parser.add_argument('--trial', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.trial:
+        print(json.dumps(measure_trial(args.trial)))
+        return []
+
+    results = run_benchmark(args.trials, args.handler, args.configuration)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+    return results
+
+if __name__ == "__main__":
+    main()
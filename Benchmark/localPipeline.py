@@ -0,0 +1,414 @@
+import argparse, contextlib, hashlib, io, json, os, sys, threading, time, zlib
+from collections import defaultdict
+from typing import Optional, Dict, Any, List
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+# Local emulator of S3 -> SQS -> Rekognition Lambda -> DynamoDB stream -> Email Lambda -> SNS
+# Both handlers run in-process against in-memory stand-ins so changes can be benchmarked offline
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(REPO_DIR, 'Templates')
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class StageTimer:
+    # Collects wall-clock durations per pipeline stage, safe to share between threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.durations[stage].append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {
+                stage: {
+                    'Count': len(values),
+                    'TotalSeconds': sum(values),
+                    'MeanSeconds': sum(values) / len(values),
+                    'P95Seconds': percentile(values, 95)
+                }
+                for stage, values in self.durations.items() if values
+            }
+
+class FakeQueue:
+    # Minimal SQS/stream stand-in, receive blocks until a batch is ready or the window closes
+    def __init__(self):
+        self.messages = []
+        self.condition = threading.Condition()
+
+    def send(self, message: dict) -> None:
+        with self.condition:
+            self.messages.append((time.perf_counter(), message))
+            self.condition.notify()
+
+    def receive(self, max_messages: int, window: float) -> list:
+        deadline = time.perf_counter() + window
+        with self.condition:
+            while len(self.messages) < max_messages:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch, self.messages = self.messages[:max_messages], self.messages[max_messages:]
+            return batch
+
+class FakeS3:
+    def __init__(self, queue: FakeQueue):
+        self.objects = {}
+        self.queue = queue
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> dict:
+        etag = hashlib.md5(Body).hexdigest()
+        self.objects[(Bucket, Key)] = Body
+
+        # S3 event notification in the shape the Rekognition handler expects
+        record = {'s3': {'bucket': {'name': Bucket}, 'object': {'key': Key, 'size': len(Body), 'eTag': etag}}}
+        self.queue.send({'messageId': f"{Key}-{time.perf_counter_ns()}", 'body': json.dumps({'Records': [record]})})
+        return {'ETag': f'"{etag}"'}
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: Optional[str] = None, **kwargs) -> dict:
+        body = self.objects[(Bucket, Key)]
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body), 'ETag': etag}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        body = self.objects[(Bucket, Key)]
+        return {'ContentLength': len(body), 'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+class FakeRekognition:
+    # Deterministic results derived from the image bytes, with a configurable per-call latency
+    # Subclass and override `score` to plug in different behaviour
+    def __init__(self, s3: FakeS3, latency: float = 0.2, dark_fraction: float = 0.2, timer: Optional[StageTimer] = None):
+        self.s3 = s3
+        self.latency = latency
+        self.dark_fraction = dark_fraction
+        self.timer = timer
+
+    def _image_bytes(self, image: dict) -> bytes:
+        if 'Bytes' in image:
+            return image['Bytes']
+        obj = image['S3Object']
+        return self.s3.objects[(obj['Bucket'], obj['Name'])]
+
+    def score(self, image_bytes: bytes) -> Dict[str, int]:
+        seed = zlib.crc32(image_bytes)
+        dark = (seed % 1000) / 1000 < self.dark_fraction
+        return {
+            'similarity': seed % 50 if dark else 50 + seed % 50,
+            'foreground': seed % 100,
+            'background': seed % 10 if dark else 10 + seed % 90
+        }
+
+    def _call(self, name: str) -> None:
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        if self.timer:
+            self.timer.record(f"rekognition.{name}", time.perf_counter() - start)
+
+    def compare_faces(self, SourceImage: dict, TargetImage: dict, **kwargs) -> dict:
+        self._call('compare_faces')
+        similarity = self.score(self._image_bytes(SourceImage))['similarity']
+        return {'FaceMatches': [{'Similarity': float(similarity)}]}
+
+    def search_faces_by_image(self, CollectionId: str, Image: dict, **kwargs) -> dict:
+        self._call('search_faces_by_image')
+        similarity = self.score(self._image_bytes(Image))['similarity']
+        return {'FaceMatches': [{'Similarity': float(similarity), 'Face': {'FaceId': 'local'}}]}
+
+    def detect_labels(self, Image: dict, **kwargs) -> dict:
+        self._call('detect_labels')
+        scores = self.score(self._image_bytes(Image))
+        return {'ImageProperties': {
+            'Foreground': {'Quality': {'Brightness': float(scores['foreground'])}},
+            'Background': {'Quality': {'Brightness': float(scores['background'])}}
+        }}
+
+class FakeTable:
+    # Writes are converted to DynamoDB stream records (NEW_IMAGE view) when a stream is attached
+    def __init__(self, name: str, key_name: str = 'id', stream: Optional[FakeQueue] = None):
+        self.name = name
+        self.key_name = key_name
+        self.items = {}
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.serializer = TypeSerializer()
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        with self.lock:
+            key = Item[self.key_name]
+            event_name = 'MODIFY' if key in self.items else 'INSERT'
+            self.items[key] = dict(Item)
+        if self.stream:
+            new_image = {k: self.serializer.serialize(v) for k, v in Item.items()}
+            self.stream.send({'eventName': event_name, 'dynamodb': {'NewImage': new_image}})
+        return {}
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        item = self.items.get(Key[self.key_name])
+        return {'Item': dict(item)} if item else {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        with self.lock:
+            self.items.pop(Key[self.key_name], None)
+        return {}
+
+    def _condition_holds(self, item: Optional[dict], condition: str, names: dict, values: dict) -> bool:
+        # Understands the OR-joined attribute_exists / attribute_not_exists / <> terms the handler writes
+        item = item or {}
+        for term in condition.split(' OR '):
+            term = term.strip()
+            if term.startswith('attribute_not_exists('):
+                if names[term[21:-1]] not in item:
+                    return True
+            elif term.startswith('attribute_exists('):
+                if names[term[17:-1]] in item:
+                    return True
+            else:
+                name, value = [t.strip() for t in term.split('<>')]
+                if names[name] in item and item[names[name]] != values[value]:
+                    return True
+        return False
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeNames: dict,
+                    ExpressionAttributeValues: dict, ConditionExpression: Optional[str] = None, **kwargs) -> dict:
+        with self.lock:
+            existing = self.items.get(Key[self.key_name])
+            if ConditionExpression and not self._condition_holds(existing, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'UpdateItem')
+
+            item = dict(existing or Key)
+            set_part, _, remove_part = UpdateExpression.partition(' REMOVE ')
+            for assignment in set_part[len('SET '):].split(', '):
+                name, value = [t.strip() for t in assignment.split('=')]
+                item[ExpressionAttributeNames[name]] = ExpressionAttributeValues[value]
+            for name in filter(None, [n.strip() for n in remove_part.split(',')]):
+                item.pop(ExpressionAttributeNames[name], None)
+        self.put_item(Item=item)
+        return {}
+
+    def batch_writer(self, **kwargs):
+        return FakeBatchWriter(self)
+
+class FakeBatchWriter:
+    def __init__(self, table: FakeTable):
+        self.table = table
+        self.pending = []
+
+    def put_item(self, Item: dict) -> None:
+        self.pending.append(Item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for item in self.pending:
+            self.table.put_item(Item=item)
+        self.pending = []
+
+class FakeDynamoResource:
+    def __init__(self, key_names: Optional[Dict[str, str]] = None, streams: Optional[Dict[str, FakeQueue]] = None):
+        self.tables = {}
+        self.key_names = key_names or {}
+        self.streams = streams or {}
+
+    def Table(self, name: str) -> FakeTable:
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.key_names.get(name, 'id'), self.streams.get(name))
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            responses[name] = [dict(table.items[k[table.key_name]]) for k in request['Keys'] if k[table.key_name] in table.items]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+class FakeSNS:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, TopicArn: str, Message: str, **kwargs) -> dict:
+        self.messages.append({'TopicArn': TopicArn, 'Message': Message, 'Subject': kwargs.get('Subject')})
+        return {'MessageId': str(len(self.messages))}
+
+def load_handlers(table_name: str):
+    # Clients are only built if a handler asks for one that was not overridden, which only needs a region
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['DYNAMODB_TABLE'] = table_name
+    os.environ['SNS_TOPIC_ARN'] = 'arn:aws:sns:local:000000000000:alerts'
+    if TEMPLATES_DIR not in sys.path:
+        sys.path.insert(0, TEMPLATES_DIR)
+    import RekognitionLambdaFunction, EmailLambdaFunction
+    return RekognitionLambdaFunction, EmailLambdaFunction
+
+def record_handler_metrics(timer: StageTimer, sink) -> None:
+    # Stage timings the handlers emitted as EMF, reported next to the benchmark's own stages
+    for document in sink.documents:
+        service = document['Service']
+        for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']:
+            if metric['Unit'] == 'Milliseconds':
+                for value in document[metric['Name']]:
+                    timer.record(f"{service}.{metric['Name']}", value / 1000)
+
+def run_benchmark(images: int = 100, rate: float = 20.0, rekognition_latency: float = 0.2,
+                  concurrency: int = 4, batch_size: int = 10, batch_window: float = 0.5,
+                  image_size: int = 32 * 1024, dark_fraction: float = 0.2,
+                  rekognition_factory=FakeRekognition, timeout: float = 300.0) -> Dict[str, Any]:
+    timer = StageTimer()
+    sqs = FakeQueue()
+    stream = FakeQueue()
+    s3 = FakeS3(sqs)
+    dynamodb = FakeDynamoResource(streams={'local-results': stream})
+    sns = FakeSNS()
+    rekognition = rekognition_factory(s3, latency=rekognition_latency, dark_fraction=dark_fraction, timer=timer)
+
+    # Point both handlers at the local stand-ins
+    rek_handler, email_handler = load_handlers('local-results')
+    import LambdaClients, LambdaMetrics
+    metrics_sink = LambdaMetrics.MemorySink()
+    LambdaMetrics.set_sink(metrics_sink)
+    LambdaClients.override('client', 's3', s3)
+    LambdaClients.override('client', 'rekognition', rekognition)
+    LambdaClients.override('resource', 'dynamodb', dynamodb)
+    LambdaClients.override('client', 'sns', sns)
+
+    bucket = 'local-bucket'
+    # The reference image is in place before the run, written directly so it raises no event
+    reference_key = os.environ.get('SOURCE_IMAGE', 'images/groupphoto.png')
+    s3.objects[(bucket, reference_key)] = os.urandom(image_size)
+    uploaded_at = {}
+    completed_at = {}
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def rekognition_worker():
+        while not done.is_set():
+            batch = sqs.receive(batch_size, batch_window)
+            if not batch:
+                continue
+            now = time.perf_counter()
+            for sent, _ in batch:
+                timer.record('sqs.wait', now - sent)
+
+            messages = {m['messageId']: m for _, m in batch}
+            start = time.perf_counter()
+            response = rek_handler.lambda_handler({'Records': list(messages.values())}, None)
+            timer.record('lambda.rekognition', time.perf_counter() - start)
+
+            # Failed messages go back on the queue like an SQS redelivery
+            for failure in (response or {}).get('batchItemFailures', []):
+                sqs.send(messages[failure['itemIdentifier']])
+
+    def stream_worker():
+        while not done.is_set():
+            batch = stream.receive(100, batch_window)
+            if not batch:
+                continue
+            now = time.perf_counter()
+            for sent, _ in batch:
+                timer.record('stream.wait', now - sent)
+
+            start = time.perf_counter()
+            email_handler.lambda_handler({'Records': [r for _, r in batch]}, None)
+            finished = time.perf_counter()
+            timer.record('lambda.email', finished - start)
+
+            with lock:
+                for _, record in batch:
+                    key = record['dynamodb']['NewImage']['id']['S']
+                    completed_at.setdefault(key, finished)
+                if len(completed_at) >= images:
+                    done.set()
+
+    workers = [threading.Thread(target=rekognition_worker, daemon=True) for _ in range(concurrency)]
+    workers.append(threading.Thread(target=stream_worker, daemon=True))
+    for worker in workers:
+        worker.start()
+
+    # Drive a synthetic image stream at the target rate
+    start_time = time.perf_counter()
+    for i in range(images):
+        target = start_time + i / rate
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        key = f"bench/image{i}.jpg"
+        body = i.to_bytes(8, 'big') + os.urandom(max(0, image_size - 8))
+        uploaded_at[key] = time.perf_counter()
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+    done.wait(timeout)
+    elapsed = time.perf_counter() - start_time
+    done.set()
+    for worker in workers:
+        worker.join()
+
+    LambdaMetrics.set_sink(None)
+    record_handler_metrics(timer, metrics_sink)
+
+    latencies = [completed_at[k] - uploaded_at[k] for k in completed_at if k in uploaded_at]
+    return {
+        'Images': images,
+        'Completed': len(latencies),
+        'ElapsedSeconds': elapsed,
+        'ImagesPerSecond': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'LatencyP50': percentile(latencies, 50),
+        'LatencyP95': percentile(latencies, 95),
+        'LatencyP99': percentile(latencies, 99),
+        'AlertsPublished': len(sns.messages),
+        'Stages': timer.summary()
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"Completed {report['Completed']}/{report['Images']} images in {report['ElapsedSeconds']:.2f}s "
+          f"({report['ImagesPerSecond']:.2f} images/sec)")
+    print(f"End-to-end latency p50 {report['LatencyP50']:.3f}s, p95 {report['LatencyP95']:.3f}s, p99 {report['LatencyP99']:.3f}s")
+    print(f"Alerts published: {report['AlertsPublished']}")
+    for stage, stats in sorted(report['Stages'].items()):
+        print(f"  {stage:<36} count {stats['Count']:>6}  mean {stats['MeanSeconds']:.4f}s  p95 {stats['P95Seconds']:.4f}s")
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Run the face pipeline locally and report throughput and latency")
+    parser.add_argument('--images', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=20.0, help="Upload rate in images per second")
+    parser.add_argument('--latency-ms', type=float, default=200.0, help="Fake Rekognition latency per call")
+    parser.add_argument('--concurrency', type=int, default=4, help="Concurrent Rekognition Lambda invocations")
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--batch-window', type=float, default=0.5)
+    parser.add_argument('--image-size', type=int, default=32 * 1024)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="Show the handlers' own output")
+    args = parser.parse_args(argv)
+
+    # Handler output is discarded unless asked for, printing is not what is being measured
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        report = run_benchmark(
+            images=args.images,
+            rate=args.rate,
+            rekognition_latency=args.latency_ms / 1000,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            batch_window=args.batch_window,
+            image_size=args.image_size
+        )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-import boto3
+import sys
 import time
 import subprocess
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import awsClients
+
 # Configuration
 KEY_PATH = '/home/calum/Downloads/labsuser.pem'
 GITHUB_REPO = 'https://github.com/Devorlon/CPDCW1.git'
@@ -13,7 +16,7 @@ KEY_NAME = 'vockey'
 ANSIBLE_PLAYBOOK = 'ec2Provisioning.yaml'
 ANSIBLE_INVENTORY = 'inventory.ini'
 
-ec2 = boto3.client('ec2')
+ec2 = awsClients.get_client('ec2')
 
 def delete_existing_instances():
     try:
@@ -64,7 +67,7 @@ def create_ec2_instance():
     return None
 
 def create_security_group(group_name, description="Allow SSH access"):
-    ec2 = boto3.resource('ec2')
+    ec2 = awsClients.get_resource('ec2')
 
     try:
         vpc = list(ec2.vpcs.all())[0]
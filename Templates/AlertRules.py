@@ -0,0 +1,208 @@
+import operator
+import os
+import re
+import threading
+from itertools import compress
+from typing import Optional
+
+# Alert rules over the stored result attributes, shared by both handlers and by faceSetup.
+#
+#   lowLight: backgroundBrightness < 10 and highestSimilarity < 55; overnight: timestamp >= '2026-01-01T22'
+#
+# Rules are separated by ';' or new lines and alert when all of their conditions hold. A value in quotes
+# compares as a string, e.g. the ISO timestamp, anything else as a number. Rules are parsed once per
+# execution environment, then every condition runs over a whole column of the batch at a time rather
+# than interpreting the rules again for each record
+
+OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '=': operator.eq, '!=': operator.ne}
+
+# Stream records are filtered before the handler runs, ordering comparisons only exist for numbers there
+STREAM_EVENTS = ['INSERT', 'MODIFY']
+
+_CONDITION = re.compile(r"\s*([A-Za-z_]\w*)\s*(<=|>=|!=|==|=|<|>)\s*('[^']*'|\"[^\"]*\"|[-+]?\d+(?:\.\d+)?)\s*")
+_AND = re.compile(r"and\b", re.IGNORECASE)
+_NAME = re.compile(r"\s*([A-Za-z_][\w.-]*)\s*:")
+
+def default_rules(brightness_below: float = 10, similarity_below: float = 55) -> str:
+    # The thresholds the pipeline used before rules were configurable
+    return f"lowLightUnknownFace: backgroundBrightness < {brightness_below} and highestSimilarity < {similarity_below}"
+
+def parse_value(text: str):
+    if text[0] in "'\"":
+        return text[1:-1]
+    value = float(text)
+    return int(value) if value.is_integer() and '.' not in text else value
+
+def parse_rules(text: str) -> list:
+    rules = []
+    for index, line in enumerate(part for part in re.split(r"[;\n]", text or '') if part.strip()):
+        name_match = _NAME.match(line)
+        name = name_match.group(1) if name_match else f"rule{index + 1}"
+        position = name_match.end() if name_match else 0
+
+        conditions = []
+        while True:
+            match = _CONDITION.match(line, position)
+            if not match:
+                raise ValueError(f"Could not parse alert rule '{line.strip()}' at '{line[position:].strip()}'")
+            attribute, symbol, value = match.groups()
+            conditions.append((attribute, '=' if symbol == '==' else symbol, parse_value(value)))
+            position = match.end()
+            if position == len(line):
+                break
+            separator = _AND.match(line, position)
+            if not separator:
+                raise ValueError(f"Expected 'and' in alert rule '{line.strip()}' at '{line[position:].strip()}'")
+            position = separator.end()
+
+        if name in [rule['Name'] for rule in rules]:
+            raise ValueError(f"Alert rule {name} is defined more than once")
+        rules.append({'Name': name, 'Conditions': conditions})
+    return rules
+
+def value_type(value) -> str:
+    return 'S' if isinstance(value, str) else 'N'
+
+class RuleSet:
+    def __init__(self, rules: list):
+        self.rules = rules
+
+        # Each attribute is decoded once per batch, however many conditions read it
+        self.columns = sorted({(attribute, value_type(value)) for rule in rules for attribute, _, value in rule['Conditions']})
+        self.compiled = [
+            (rule['Name'], [(self.columns.index((attribute, value_type(value))), OPERATORS[symbol], value)
+                            for attribute, symbol, value in rule['Conditions']])
+            for rule in rules
+        ]
+
+    @property
+    def attributes(self) -> list:
+        return sorted({attribute for attribute, _ in self.columns})
+
+    def evaluate(self, columns: list, size: int) -> list:
+        # The names of the rules each row matched, a missing attribute never matches
+        matched = [[] for _ in range(size)]
+        for name, conditions in self.compiled:
+            mask = [True] * size
+            for column, compare, value in conditions:
+                mask = [m and v is not None and compare(v, value) for m, v in zip(mask, columns[column])]
+            for row in compress(range(size), mask):
+                matched[row].append(name)
+        return matched
+
+    def match_images(self, images: list) -> list:
+        # DynamoDB stream NewImages, values are still typed e.g. {'N': '12'}
+        columns = []
+        for attribute, kind in self.columns:
+            values = [image.get(attribute, {}).get(kind) for image in images]
+            columns.append(values if kind == 'S' else [None if v is None else float(v) for v in values])
+        return self.evaluate(columns, len(images))
+
+    def match_items(self, items: list) -> list:
+        # Plain result items as the Rekognition handler builds them
+        columns = []
+        for attribute, kind in self.columns:
+            values = [item.get(attribute) for item in items]
+            if kind == 'S':
+                columns.append([v if isinstance(v, str) else None for v in values])
+            else:
+                columns.append([None if v is None or isinstance(v, (str, bool)) else v for v in values])
+        return self.evaluate(columns, len(items))
+
+    def severity(self, names: list, values: dict) -> float:
+        # How far the matched rules' numeric conditions are past their thresholds, each relative to its
+        # threshold so attributes on different scales add up. 0 when the values or rules are unknown
+        total = 0.0
+        for rule in self.rules:
+            if rule['Name'] not in names:
+                continue
+            for attribute, symbol, threshold in rule['Conditions']:
+                if value_type(threshold) != 'N' or symbol not in ['<', '<=', '>', '>=']:
+                    continue
+                try:
+                    value = float(values[attribute])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                margin = threshold - value if symbol in ['<', '<='] else value - threshold
+                total += max(margin, 0) / max(abs(threshold), 1)
+        return total
+
+    def filter_patterns(self) -> list:
+        # One event source filter per rule, which Lambda ORs together. A condition a filter cannot express
+        # is left out, that only lets extra records through and the handler evaluates the rules again
+        patterns = []
+        for rule in self.rules:
+            new_image = {}
+            for attribute in dict.fromkeys(attribute for attribute, _, _ in rule['Conditions']):
+                conditions = [(symbol, value) for name, symbol, value in rule['Conditions'] if name == attribute]
+                criteria = numeric_criteria(conditions) if value_type(conditions[0][1]) == 'N' else string_criteria(conditions)
+                if criteria:
+                    new_image[attribute] = criteria
+
+            pattern = {'eventName': STREAM_EVENTS}
+            if new_image:
+                pattern['dynamodb'] = {'NewImage': new_image}
+            patterns.append(pattern)
+        return patterns
+
+def tighter(bound: Optional[tuple], symbol: str, value, upper: bool) -> tuple:
+    # Of two bounds on the same side keep the stricter one, at the same value the exclusive one
+    if bound is None:
+        return symbol, value
+    if value != bound[1]:
+        return (symbol, value) if (value < bound[1]) == upper else bound
+    return (symbol, value) if len(symbol) == 1 else bound
+
+def numeric_criteria(conditions: list) -> Optional[dict]:
+    # A numeric range is at most one lower bound followed by one upper bound
+    if any(value_type(value) != 'N' for _, value in conditions):
+        return None
+    equal = [value for symbol, value in conditions if symbol == '=']
+    if equal:
+        return {'N': [{'numeric': ['=', equal[0]]}]}
+
+    lower = upper = None
+    for symbol, value in conditions:
+        if symbol in ['>', '>=']:
+            lower = tighter(lower, symbol, value, upper=False)
+        elif symbol in ['<', '<=']:
+            upper = tighter(upper, symbol, value, upper=True)
+    numeric = [part for bound in [lower, upper] if bound for part in bound]
+    return {'N': [{'numeric': numeric}]} if numeric else None
+
+def string_criteria(conditions: list) -> Optional[dict]:
+    if len(conditions) != 1 or value_type(conditions[0][1]) != 'S':
+        return None
+    symbol, value = conditions[0]
+    if symbol == '=':
+        return {'S': [value]}
+    if symbol == '!=':
+        return {'S': [{'anything-but': [value]}]}
+    return None
+
+def configured_rules() -> str:
+    # An SSM parameter takes precedence, so thresholds can change without deploying the functions again
+    parameter = os.environ.get('ALERT_RULES_PARAMETER')
+    if parameter:
+        import LambdaClients
+        return LambdaClients.client('ssm').get_parameter(Name=parameter, WithDecryption=True)['Parameter']['Value']
+    if os.environ.get('ALERT_RULES'):
+        return os.environ['ALERT_RULES']
+    return default_rules(int(os.environ.get('ALERT_BRIGHTNESS_BELOW', '10')), int(os.environ.get('ALERT_SIMILARITY_BELOW', '55')))
+
+_lock = threading.Lock()
+_active: Optional[RuleSet] = None
+
+def active() -> RuleSet:
+    # Compiled once per execution environment, a changed parameter is picked up by the next cold start
+    global _active
+    if _active is None:
+        with _lock:
+            if _active is None:
+                _active = RuleSet(parse_rules(configured_rules()))
+    return _active
+
+def reset() -> None:
+    global _active
+    with _lock:
+        _active = None
@@ -1,37 +1,215 @@
 import os
-import boto3
+import time
+from botocore.exceptions import ClientError
+import AlertRules
+import LambdaClients
+import LambdaMetrics
 
-sns = boto3.client('sns')
+metrics = LambdaMetrics.Metrics('EmailLambda')
 
-def lambda_handler(event, context):
-    topic_arn = os.environ['SNS_TOPIC_ARN']
+# Alerts are buffered per time window and sent as one digest when aggregation is enabled
+ALERT_TABLE = os.environ.get('ALERT_TABLE')
+ALERT_WINDOW_SECONDS = int(os.environ.get('ALERT_WINDOW_SECONDS', '300'))
+ALERT_TOP_N = int(os.environ.get('ALERT_TOP_N', '10'))
+DIGEST_KEY = 'digest'
+AGGREGATE_ALERTS = bool(ALERT_TABLE) and ALERT_WINDOW_SECONDS > 0
+
+# A digest claimed longer ago than this belongs to an invocation that timed out or crashed, defaults to Lambda's maximum timeout
+DIGEST_LEASE_SECONDS = int(os.environ.get('DIGEST_LEASE_SECONDS', '900'))
+
+# Built on first use, or during init when PREWARM_CLIENTS is set
+WARM_CLIENTS = ['sns']
+WARM_TABLES = [ALERT_TABLE]
+if LambdaClients.PREWARM:
+    LambdaClients.warm(WARM_CLIENTS, WARM_TABLES)
+    AlertRules.active()
+
+def new_images(records: list) -> list:
+    return [record['dynamodb']['NewImage'] for record in records
+            if record.get('eventName') in AlertRules.STREAM_EVENTS and 'NewImage' in record.get('dynamodb', {})]
+
+def find_alerts(images: list) -> list:
+    # The rules run over the whole batch at once, only matching images are unpacked further
+    rules = AlertRules.active()
     alerts = []
-    
-    for record in event['Records']:
+    for image, matched in zip(images, rules.match_images(images)):
+        if not matched:
+            continue
+        values = {}
+        for attribute in rules.attributes:
+            typed = image.get(attribute, {})
+            if 'N' in typed or 'S' in typed:
+                values[attribute] = typed.get('N', typed.get('S'))
+        alerts.append({'imageId': image['id']['S'], 'rules': matched, 'values': values})
+        LambdaMetrics.debug(f"Alert: {image['id']['S']}, {matched} {values}")
+    return alerts
+
+def format_alert(alert: dict) -> str:
+    values = ", ".join(f"{attribute}: {value}" for attribute, value in alert.get('values', {}).items())
+    return f"Image: {alert['imageId']} - Matched {', '.join(alert.get('rules', []))} ({values})"
+
+def window_id(timestamp: float) -> str:
+    # Zero padded so windows sort correctly as strings
+    return f"{int(timestamp // ALERT_WINDOW_SECONDS):012d}"
+
+def buffer_alerts(alerts: list, now: float) -> int:
+    # Imported here so boto3 is only loaded once a request needs it
+    from boto3.dynamodb.conditions import Attr
+    table = LambdaClients.table(ALERT_TABLE)
+    window = window_id(now)
+    expires_at = int(now) + 7 * 24 * 3600
+
+    # Writing by image id dedups repeat alerts for the same image within a window
+    unique = {alert['imageId']: alert for alert in alerts}
+    with table.batch_writer(overwrite_by_pkeys=['alertWindow', 'imageId']) as batch:
+        for alert in unique.values():
+            batch.put_item(Item=dict(alert, alertWindow=f"window#{window}", expiresAt=expires_at))
+
+    # Register the window so a later invocation knows there is a digest to send
+    try:
+        table.put_item(
+            Item={'alertWindow': DIGEST_KEY, 'imageId': window, 'status': 'pending', 'expiresAt': expires_at},
+            ConditionExpression=Attr('alertWindow').not_exists()
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    return len(unique)
+
+def claim_window(table, window: str, now: float) -> bool:
+    from boto3.dynamodb.conditions import Attr
+    # Only one invocation gets to send each digest, a claim whose lease ran out is taken over
+    lease_expired = Attr('status').eq('sending') & (Attr('claimedAt').not_exists() | Attr('claimedAt').lt(int(now) - DIGEST_LEASE_SECONDS))
+    try:
+        table.update_item(
+            Key={'alertWindow': DIGEST_KEY, 'imageId': window},
+            UpdateExpression='SET #s = :sending, claimedAt = :now',
+            ConditionExpression=Attr('status').eq('pending') | lease_expired,
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={':sending': 'sending', ':now': int(now)}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def query_all(table, **kwargs) -> list:
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def set_window_status(table, window: str, status: str) -> None:
+    table.update_item(
+        Key={'alertWindow': DIGEST_KEY, 'imageId': window},
+        UpdateExpression='SET #s = :status',
+        ExpressionAttributeNames={'#s': 'status'},
+        ExpressionAttributeValues={':status': status}
+    )
+
+def offender_rank(alert: dict) -> tuple:
+    # Furthest past the rule thresholds first, then the darkest and least similar, e.g. for rows
+    # buffered before rules were configurable or matched by rules that have since changed
+    values = alert.get('values', {})
+    severity = AlertRules.active().severity(alert.get('rules', []), values)
+
+    def stored(attribute: str) -> float:
         try:
-            if record['eventName'] in ['INSERT', 'MODIFY']:
-                new_image = record['dynamodb']['NewImage']
-                
-                # Extract image name (id)
-                image_id = new_image['id']['S']  # 'S' indicates string type
-                
-                # Extract metrics
-                bb = int(new_image['backgroundBrightness']['N'])
-                hs = int(new_image['highestSimilarity']['N'])
-                
-                if bb < 10 and hs < 55:
-                    alerts.append(f'Image: {image_id} - Low values detected (Brightness: {bb}, Similarity: {hs})')
-            
-            print(f"Processed: {image_id}, (Brightness: {bb}, Similarity: {hs})")
-        except Exception as e:
-            print(f"Error processing record: {str(e)}")
-    
-    if alerts:
-        message = "\n".join(alerts)
-        sns.publish(
+            return float(values.get(attribute, alert.get(attribute)))
+        except (TypeError, ValueError):
+            return float('inf')
+    return -severity, stored('backgroundBrightness'), stored('highestSimilarity'), alert['imageId']
+
+def send_digest(table, topic_arn: str, window: str) -> None:
+    from boto3.dynamodb.conditions import Key
+    alerts = query_all(table, KeyConditionExpression=Key('alertWindow').eq(f"window#{window}"))
+    offenders = sorted(alerts, key=offender_rank)
+    start = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(window) * ALERT_WINDOW_SECONDS))
+
+    lines = [f"{len(alerts)} images matched alert rules in the {ALERT_WINDOW_SECONDS}s window starting {start} UTC"]
+    if len(alerts) > ALERT_TOP_N:
+        lines.append(f"Top {ALERT_TOP_N} offenders:")
+    lines.extend(format_alert(a) for a in offenders[:ALERT_TOP_N])
+
+    with metrics.timer('SnsPublish'):
+        LambdaClients.client('sns').publish(
             TopicArn=topic_arn,
-            Message=message,
+            Message="\n".join(lines),
             Subject='Security Alert Notification'
         )
-    
-    return f"Processed {len(event['Records'])} records"
\ No newline at end of file
+
+def flush_digests(topic_arn: str, now: float) -> int:
+    from boto3.dynamodb.conditions import Key, Attr
+    # Send one digest for every closed window that still has pending alerts, or whose sender never finished.
+    # A window is only flushed once it closed a lease ago, an invocation that started just before the
+    # boundary may still be buffering into it until its timeout
+    table = LambdaClients.table(ALERT_TABLE)
+    pending = query_all(
+        table,
+        KeyConditionExpression=Key('alertWindow').eq(DIGEST_KEY) & Key('imageId').lt(window_id(now - DIGEST_LEASE_SECONDS)),
+        FilterExpression=Attr('status').is_in(['pending', 'sending'])
+    )
+
+    sent = 0
+    for marker in pending:
+        window = marker['imageId']
+        if not claim_window(table, window, now):
+            continue
+
+        try:
+            send_digest(table, topic_arn, window)
+        except Exception:
+            # Hand the window back so the next invocation retries it
+            set_window_status(table, window, 'pending')
+            raise
+        set_window_status(table, window, 'sent')
+        sent += 1
+    return sent
+
+def process_records(records: list) -> None:
+    topic_arn = os.environ['SNS_TOPIC_ARN']
+
+    with metrics.timer('ParseRecords'):
+        images = new_images(records)
+        # An image without an id cannot be reported, it would fail the whole batch
+        valid = [image for image in images if 'S' in image.get('id', {})]
+        if len(valid) < len(images):
+            print(f"Skipped {len(images) - len(valid)} records without an image id")
+            metrics.count('ParseErrors', len(images) - len(valid))
+        alerts = find_alerts(valid)
+    metrics.count('Records', len(records))
+    metrics.count('Alerts', len(alerts))
+
+    if AGGREGATE_ALERTS:
+        # Buffer this batch, then send digests for any windows that have closed
+        now = time.time()
+        buffered = 0
+        if alerts:
+            with metrics.timer('DynamoDBWrite'):
+                buffered = buffer_alerts(alerts, now)
+        with metrics.timer('FlushDigests'):
+            digests = flush_digests(topic_arn, now)
+        metrics.count('Digests', digests)
+        print(f"Buffered {buffered} alerts, sent {digests} digests")
+    elif alerts:
+        message = "\n".join(format_alert(alert) for alert in alerts)
+        with metrics.timer('SnsPublish'):
+            LambdaClients.client('sns').publish(
+                TopicArn=topic_arn,
+                Message=message,
+                Subject='Security Alert Notification'
+            )
+
+def lambda_handler(event, context):
+    records = event.get('Records', [])
+    try:
+        with metrics.timer('Handler'):
+            process_records(records)
+    finally:
+        metrics.flush()
+
+    return f"Processed {len(records)} records"
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+# boto3 clients for the Lambda handlers, built on first use and kept for every later invocation.
+# Importing boto3 and loading a service model is most of a cold start, so nothing is built until a
+# request needs it. With PREWARM_CLIENTS set the handlers build theirs during init instead, which is
+# where provisioned concurrency and SnapStart take that cost off the request path
+
+PREWARM = os.environ.get('PREWARM_CLIENTS', 'false').lower() == 'true'
+
+# Reentrant because a table is built from the resource, and the default session is not thread safe
+_lock = threading.RLock()
+_cache = {}
+
+# Seconds spent building each client, for the cold start benchmark
+build_seconds = {}
+
+def _build(kind: str, name: str):
+    import boto3
+    if kind == 'client':
+        return boto3.client(name)
+    if kind == 'resource':
+        return boto3.resource(name)
+    return resource('dynamodb').Table(name)
+
+def _get(kind: str, name: str):
+    value = _cache.get((kind, name))
+    if value is None:
+        with _lock:
+            value = _cache.get((kind, name))
+            if value is None:
+                start = time.perf_counter()
+                value = _build(kind, name)
+                build_seconds[f"{kind}:{name}"] = time.perf_counter() - start
+                _cache[(kind, name)] = value
+    return value
+
+def client(service: str):
+    return _get('client', service)
+
+def resource(service: str):
+    return _get('resource', service)
+
+def table(name: str):
+    return _get('table', name)
+
+def warm(clients: list, tables: list) -> None:
+    for service in clients:
+        client(service)
+    for name in tables:
+        if name:
+            table(name)
+
+def override(kind: str, name: str, value) -> None:
+    # Lets the local benchmark substitute stand-ins, tables are rebuilt from a replaced resource
+    with _lock:
+        _cache[(kind, name)] = value
+        if kind == 'resource' and name == 'dynamodb':
+            for key in [k for k in _cache if k[0] == 'table']:
+                del _cache[key]
+
+def reset() -> None:
+    with _lock:
+        _cache.clear()
+        build_seconds.clear()
@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Stage timings and counters for the Lambda handlers, written as CloudWatch Embedded Metric Format.
+# A JSON document printed to stdout in this shape becomes CloudWatch metrics without any API calls
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'FaceApp')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# EMF accepts at most 100 values per metric in one document
+MAX_VALUES = 100
+
+def debug(message: str) -> None:
+    # Full API payloads are only worth their log volume when diagnosing something
+    if LOG_LEVEL == 'DEBUG':
+        print(message)
+
+def stdout_sink(document: dict) -> None:
+    print(json.dumps(document))
+
+class MemorySink:
+    # Keeps emitted documents in memory so tests and the local benchmark can inspect them
+    def __init__(self):
+        self.documents = []
+        self.lock = threading.Lock()
+
+    def __call__(self, document: dict) -> None:
+        with self.lock:
+            self.documents.append(document)
+
+    def values(self, name: str) -> list:
+        with self.lock:
+            values = []
+            for document in self.documents:
+                value = document.get(name)
+                if isinstance(value, list):
+                    values.extend(value)
+                elif value is not None:
+                    values.append(value)
+            return values
+
+    def metric_names(self) -> set:
+        with self.lock:
+            return {m['Name'] for d in self.documents for m in d['_aws']['CloudWatchMetrics'][0]['Metrics']}
+
+_sink = stdout_sink
+_cold_start = True
+
+def set_sink(sink) -> None:
+    global _sink
+    _sink = sink or stdout_sink
+
+class Metrics:
+    def __init__(self, service: str):
+        self.service = service
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.counts = defaultdict(int)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.timings[name].append(round(seconds * 1000, 3))
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counts[name] += value
+
+    @contextmanager
+    def timer(self, name: str):
+        # Failed calls are timed as well and counted as <name>Errors
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.count(f"{name}Errors")
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def flush(self) -> list:
+        # Timings are sent as raw values so CloudWatch can build percentiles from them
+        global _cold_start
+        with self.lock:
+            timings, counts = dict(self.timings), dict(self.counts)
+            self.timings.clear()
+            self.counts.clear()
+        counts['ColdStart'] = int(_cold_start)
+        _cold_start = False
+
+        documents = []
+        chunks = max([len(v) for v in timings.values()] + [1])
+        for offset in range(0, chunks, MAX_VALUES):
+            metrics = {name: values[offset:offset + MAX_VALUES] for name, values in timings.items() if values[offset:offset + MAX_VALUES]}
+            definitions = [{'Name': name, 'Unit': 'Milliseconds'} for name in metrics]
+
+            # Counters only go in the first document so they are not added up twice
+            if offset == 0:
+                metrics.update(counts)
+                definitions.extend({'Name': name, 'Unit': 'Count'} for name in counts)
+
+            document = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': [['Service']],
+                        'Metrics': definitions
+                    }]
+                },
+                'Service': self.service,
+                'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+            }
+            document.update(metrics)
+            documents.append(document)
+
+        for document in documents:
+            _sink(document)
+        return documents
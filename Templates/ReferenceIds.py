@@ -0,0 +1,51 @@
+import re
+
+# ExternalImageIds for reference photos, shared by crudRekognition's deploy time sync and the Rekognition
+# handler, which must agree on them exactly or the handler stops recognising what the sync indexed.
+#
+#   references/alice.jpg, ETag "3f2a..."  ->  references:alice.jpg:3f2a...
+#
+# ExternalImageId only allows [a-zA-Z0-9_.\-:]. Path separators become ':', '_' escapes itself and any
+# other byte as _XX, so the S3 key can be read back from a search match. The ETag suffix changes when a
+# photo is replaced, which is how a stale face is told apart from the current one
+
+_SAFE = re.compile(r'[a-zA-Z0-9.\-]')
+_ESCAPE = re.compile(r'_(_|[0-9A-F]{2})|:')
+
+def encode_key(key: str) -> str:
+    parts = []
+    for char in key:
+        if _SAFE.match(char):
+            parts.append(char)
+        elif char == '/':
+            parts.append(':')
+        elif char == '_':
+            parts.append('__')
+        else:
+            parts.extend(f"_{byte:02X}" for byte in char.encode())
+    return ''.join(parts)
+
+def decode_key(encoded: str) -> str:
+    def replace(match) -> bytes:
+        if match.group(0) == ':':
+            return b'/'
+        return b'_' if match.group(1) == '_' else bytes([int(match.group(1), 16)])
+
+    # Decoded as bytes first so multi-byte characters come back whole
+    decoded, position = b'', 0
+    for match in _ESCAPE.finditer(encoded):
+        decoded += encoded[position:match.start()].encode() + replace(match)
+        position = match.end()
+    return (decoded + encoded[position:].encode()).decode()
+
+def key_prefix(key: str) -> str:
+    # Every version of this key's id starts with this
+    return f"{encode_key(key)}:"
+
+def reference_id(key: str, etag: str) -> str:
+    version = etag.strip('"')[:12]
+    return f"{key_prefix(key)}{version}"
+
+def reference_key(external_id: str) -> str:
+    # The S3 key a reference id was made from, without the version suffix
+    return decode_key(external_id.rsplit(':', 1)[0])
@@ -1,100 +1,520 @@
+import io
 import json
-import boto3
 import os
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import unquote_plus
+from botocore.exceptions import ClientError
+import AlertRules
+import LambdaClients
+import LambdaMetrics
+import ReferenceIds
 
-s3_client = boto3.client('s3')
-rekognition_client = boto3.client('rekognition')
-dynamodb = boto3.resource('dynamodb')
+metrics = LambdaMetrics.Metrics('RekognitionLambda')
 
 # Get environment variables
 TABLE_NAME = os.environ['DYNAMODB_TABLE']
-table = dynamodb.Table(TABLE_NAME)
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '10'))
+FACE_COLLECTION = os.environ.get('FACE_COLLECTION')
+CACHE_TABLE = os.environ.get('CACHE_TABLE')
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+REFERENCE_VERSION = os.environ.get('REFERENCE_VERSION', '')
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '0'))
+IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', '90'))
+INLINE_IMAGES = os.environ.get('INLINE_IMAGES', 'false').lower() == 'true'
+REFERENCE_PREFIX = os.environ.get('REFERENCE_PREFIX')
+RESULT_TTL_SECONDS = int(os.environ.get('RESULT_TTL_SECONDS', '0'))
 
-def lambda_handler(event, context):
-    SOURCE_IMAGE = os.environ.get('SOURCE_IMAGE', 'images/groupphoto.png')
-    
-    for sqs_record in event.get('Records', []):
+# Pillow is not part of the Lambda runtime, it is supplied by a layer and only imported when pre-processing is wanted
+Image = None
+if IMAGE_MAX_DIMENSION > 0:
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        pass
+
+# Built on first use, or during init when PREWARM_CLIENTS is set
+WARM_CLIENTS = ['s3', 'rekognition']
+WARM_TABLES = [TABLE_NAME, CACHE_TABLE]
+if LambdaClients.PREWARM:
+    LambdaClients.warm(WARM_CLIENTS, WARM_TABLES)
+    AlertRules.active()
+
+# Rekognition only accepts inline images up to 5MB, anything larger is left for it to read from S3
+MAX_INLINE_BYTES = 5 * 1024 * 1024
+
+# The reference image survives warm invocations and is only downloaded again when its ETag changes
+reference_cache = {}
+
+# Results are copied from here when the same bytes were analysed before
+RESULT_FIELDS = ['highestSimilarity', 'foregroundBrightness', 'backgroundBrightness']
+OPTIONAL_RESULT_FIELDS = ['bestReference']
+
+# A stored row is only rewritten when one of these differs, so redelivered messages produce no stream events
+COMPARED_FIELDS = RESULT_FIELDS + OPTIONAL_RESULT_FIELDS + ['alertState']
+
+# Cache entry whose version changes whenever the reference set does, so old scores are not reused
+REFERENCE_SET_KEY = '#referenceSet'
+
+# Errors that will not go away on retry, the image gets default values instead
+PERMANENT_ERRORS = ['InvalidParameterException', 'InvalidImageFormatException', 'ImageTooLargeException', 'InvalidS3ObjectException']
+
+def is_permanent(e: Exception) -> bool:
+    return isinstance(e, ClientError) and e.response['Error']['Code'] in PERMANENT_ERRORS
+
+def parse_sqs_record(sqs_record: dict, source_image: str) -> list:
+    s3_event = json.loads(sqs_record['body'])
+
+    # Skip test events
+    if 'Event' in s3_event and s3_event['Event'] == 's3:TestEvent':
+        print("Skipping S3 test event")
+        return []
+
+    # Get bucket, image key, content hash and event type for processing
+    images = []
+    for record in s3_event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        # Keys in S3 notifications are URL encoded, spaces arrive as '+'
+        key = unquote_plus(record['s3']['object']['key'])
+        etag = record['s3']['object'].get('eTag')
+        event_name = record.get('eventName', 'ObjectCreated:Put')
+
+        # Skip processing groupphoto.png
+        if key == source_image:
+            print(f"Skipping source image: {key}")
+            continue
+        images.append((bucket, key, etag, event_name))
+    return images
+
+def is_reference(key: str) -> bool:
+    return bool(REFERENCE_PREFIX and FACE_COLLECTION and key.startswith(REFERENCE_PREFIX))
+
+def reference_faces_key(key: str) -> str:
+    # Cache entry listing the faces indexed from one reference photo
+    return f"#reference#{key}"
+
+def find_reference_faces(key: str) -> list:
+    # Recorded when the handler indexed the photo, otherwise the collection is listed, e.g. for photos
+    # indexed by the deploy time sync. ListFaces cannot filter, so the key's id prefix is matched here
+    if CACHE_TABLE:
+        item = LambdaClients.table(CACHE_TABLE).get_item(Key={'contentHash': reference_faces_key(key)}).get('Item')
+        if item:
+            return list(item.get('faceIds', []))
+
+    prefix = ReferenceIds.key_prefix(key)
+    faces = []
+    for page in LambdaClients.client('rekognition').get_paginator('list_faces').paginate(CollectionId=FACE_COLLECTION):
+        faces.extend(f['FaceId'] for f in page.get('Faces', []) if f.get('ExternalImageId', '').startswith(prefix))
+    return faces
+
+def update_reference(bucket: str, key: str, etag: Optional[str], event_name: str) -> None:
+    # Keeps the collection in step with the reference prefix as photos are added, replaced or removed
+    stale = find_reference_faces(key)
+    for i in range(0, len(stale), 4096):
+        LambdaClients.client('rekognition').delete_faces(CollectionId=FACE_COLLECTION, FaceIds=stale[i:i + 4096])
+
+    face_ids = []
+    if event_name.startswith('ObjectCreated') and etag:
+        with metrics.timer('IndexFaces'):
+            response = LambdaClients.client('rekognition').index_faces(
+                CollectionId=FACE_COLLECTION,
+                Image={'S3Object': {'Bucket': bucket, 'Name': key}},
+                ExternalImageId=ReferenceIds.reference_id(key, etag),
+                QualityFilter='AUTO'
+            )
+        face_ids = [record['Face']['FaceId'] for record in response.get('FaceRecords', [])]
+    print(f"Reference {key}: removed {len(stale)} faces, indexed {len(face_ids)}")
+    metrics.count('ReferenceUpdates')
+
+    if CACHE_TABLE:
+        table = LambdaClients.table(CACHE_TABLE)
+        if face_ids:
+            table.put_item(Item={'contentHash': reference_faces_key(key), 'faceIds': face_ids})
+        else:
+            table.delete_item(Key={'contentHash': reference_faces_key(key)})
+        table.put_item(Item={'contentHash': REFERENCE_SET_KEY, 'version': str(time.time_ns())})
+
+def get_reference_set_version() -> Optional[str]:
+    # None when the version cannot be read, the batch then bypasses the result cache
+    if not (REFERENCE_PREFIX and CACHE_TABLE):
+        return ''
+    try:
+        item = LambdaClients.table(CACHE_TABLE).get_item(Key={'contentHash': REFERENCE_SET_KEY}).get('Item')
+        return item['version'] if item else ''
+    except Exception as e:
+        print(f"Error reading reference set version: {str(e)}")
+        return None
+
+def cache_key(etag: str, source_image: str, set_version: str = '') -> str:
+    # A changed reference image must not reuse old similarity scores
+    reference = FACE_COLLECTION or source_image
+    return f"{etag}#{reference}#{REFERENCE_VERSION}{set_version}"
+
+def get_cached_results(keys: list) -> dict:
+    if not CACHE_TABLE or not keys:
+        return {}
+
+    cached = {}
+    try:
+        for i in range(0, len(keys), 100):
+            response = LambdaClients.resource('dynamodb').batch_get_item(
+                RequestItems={CACHE_TABLE: {'Keys': [{'contentHash': k} for k in keys[i:i + 100]]}}
+            )
+            # Unprocessed keys are simply treated as misses
+            for item in response.get('Responses', {}).get(CACHE_TABLE, []):
+                if int(item.get('expiresAt', 0)) > time.time():
+                    result = {f: int(item[f]) for f in RESULT_FIELDS}
+                    result.update({f: item[f] for f in OPTIONAL_RESULT_FIELDS if f in item})
+                    cached[item['contentHash']] = result
+    except Exception as e:
+        print(f"Error reading result cache: {str(e)}")
+    return cached
+
+def put_cached_results(results: dict) -> None:
+    if not CACHE_TABLE or not results:
+        return
+
+    expires_at = int(time.time()) + CACHE_TTL_SECONDS
+    try:
+        with LambdaClients.table(CACHE_TABLE).batch_writer(overwrite_by_pkeys=['contentHash']) as batch:
+            for content_hash, item in results.items():
+                entry = {f: item[f] for f in RESULT_FIELDS + OPTIONAL_RESULT_FIELDS if f in item}
+                entry.update({'contentHash': content_hash, 'expiresAt': expires_at})
+                batch.put_item(Item=entry)
+    except Exception as e:
+        print(f"Error writing result cache: {str(e)}")
+
+def preprocessing_enabled() -> bool:
+    return IMAGE_MAX_DIMENSION > 0 and Image is not None
+
+def normalise_image(data: bytes) -> bytes:
+    # Decode once, downsize to the max dimension and re-encode without EXIF or other metadata
+    with Image.open(io.BytesIO(data)) as original:
+        image_format = original.format
+        output = io.BytesIO()
+
+        # Small upright JPEGs reuse their own quantisation tables, so stripping metadata does not grow them
+        upright = original.getexif().get(0x0112, 1) == 1
+        if image_format == 'JPEG' and upright and max(original.size) <= IMAGE_MAX_DIMENSION:
+            original.save(output, format='JPEG', quality='keep', optimize=True)
+            return output.getvalue()
+
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        if image_format == 'PNG':
+            image.save(output, format='PNG', optimize=True)
+        else:
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(output, format='JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
+        return output.getvalue()
+
+def inline_enabled() -> bool:
+    return INLINE_IMAGES or preprocessing_enabled()
+
+def prepare_image(bucket: str, key: str, data: bytes) -> dict:
+    # Turns downloaded bytes into the Rekognition Image parameter, downsized when pre-processing is on
+    if preprocessing_enabled():
         try:
-            s3_event = json.loads(sqs_record['body'])
-            
-            # Skip test events
-            if 'Event' in s3_event and s3_event['Event'] == 's3:TestEvent':
-                print("Skipping S3 test event")
-                continue
+            with metrics.timer('Preprocess'):
+                normalised = normalise_image(data)
+            LambdaMetrics.debug(f"Pre-processed {key}: {len(data)} -> {len(normalised)} bytes")
+            data = normalised
+        except Exception as e:
+            # Anything Pillow cannot read is passed through and left for Rekognition to judge
+            print(f"Could not pre-process {key}, using original: {str(e)}")
 
-            # Get bucket and image key for processing    
-            record = s3_event['Records'][0]
-            bucket = record['s3']['bucket']['name']
-            key = record['s3']['object']['key']
-            
-            # Skip processing groupphoto.png
-            if key == SOURCE_IMAGE:
-                print(f"Skipping source image: {key}")
-                continue
-            
-            print(f"Processing image: {key}")
-            
-            # Face Comparison
+    if len(data) > MAX_INLINE_BYTES:
+        print(f"{key} is too large to send inline, Rekognition will read it from S3")
+        return {'S3Object': {'Bucket': bucket, 'Name': key}}
+    return {'Bytes': data}
+
+def load_image(bucket: str, key: str) -> dict:
+    if not inline_enabled():
+        return {'S3Object': {'Bucket': bucket, 'Name': key}}
+
+    # One read feeds both Rekognition calls
+    with metrics.timer('FetchImage'):
+        data = LambdaClients.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read()
+    return prepare_image(bucket, key, data)
+
+def load_reference(bucket: str, key: str) -> dict:
+    if not inline_enabled():
+        return {'S3Object': {'Bucket': bucket, 'Name': key}}
+
+    # A conditional GET costs one request and no transfer while the reference is unchanged
+    cached = reference_cache.get((bucket, key))
+    try:
+        with metrics.timer('FetchReference'):
+            if cached:
+                response = LambdaClients.client('s3').get_object(Bucket=bucket, Key=key, IfNoneMatch=cached['ETag'])
+            else:
+                response = LambdaClients.client('s3').get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if cached and e.response['Error']['Code'] in ['304', 'NotModified']:
+            metrics.count('ReferenceCacheHits')
+            return cached['Image']
+        raise
+
+    print(f"Loaded reference image {key} ({response['ETag']})")
+    image = prepare_image(bucket, key, response['Body'].read())
+    reference_cache[(bucket, key)] = {'ETag': response['ETag'], 'Image': image}
+    return image
+
+def compare_face(image: dict, key: str, reference: dict) -> int:
+    try:
+        with metrics.timer('CompareFaces'):
+            comp_response = LambdaClients.client('rekognition').compare_faces(
+                SourceImage=image,
+                TargetImage=reference,
+                SimilarityThreshold=70
+            )
+    except ClientError as e:
+        if not is_permanent(e):
+            raise
+        print(f"Error in face comparison for {key}: {str(e)}")
+        return 0  # Default value on failure
+
+    # Get highest similarity
+    max_similarity = 0
+    for match in comp_response.get('FaceMatches', []):
+        similarity = match.get('Similarity', 0)
+        if similarity > max_similarity:
+            max_similarity = int(similarity)
+
+    LambdaMetrics.debug(f"Comparison Response: {comp_response}\n Max Similarity: {max_similarity}")
+    return max_similarity
+
+def search_face(image: dict, key: str, collection_id: str) -> tuple:
+    # Indexed mode: one search covers every reference in the collection, however many there are
+    try:
+        with metrics.timer('SearchFaces'):
+            search_response = LambdaClients.client('rekognition').search_faces_by_image(
+                CollectionId=collection_id,
+                Image=image,
+                FaceMatchThreshold=70,
+                MaxFaces=1
+            )
+    except ClientError as e:
+        if not is_permanent(e):
+            raise
+        print(f"Error in face search for {key}: {str(e)}")
+        return 0, None  # Default value on failure
+
+    # Matches are sorted by similarity, highest first
+    matches = search_response.get('FaceMatches', [])
+    max_similarity = int(matches[0].get('Similarity', 0)) if matches else 0
+    external_id = matches[0].get('Face', {}).get('ExternalImageId') if matches else None
+    best_reference = ReferenceIds.reference_key(external_id) if external_id else None
+
+    LambdaMetrics.debug(f"Search Response: {search_response}\n Max Similarity: {max_similarity}")
+    return max_similarity, best_reference
+
+def detect_brightness(image: dict, key: str) -> tuple:
+    try:
+        with metrics.timer('DetectLabels'):
+            labels_response = LambdaClients.client('rekognition').detect_labels(
+                Image=image,
+                Features=['IMAGE_PROPERTIES'],
+                Settings={'ImageProperties': {'MaxDominantColors': 20}}
+            )
+    except ClientError as e:
+        if not is_permanent(e):
+            raise
+        print(f"Error in image properties detection for {key}: {str(e)}")
+        return 0, 0
+
+    # Extract brightness values
+    LambdaMetrics.debug(f"Labels Response: {labels_response}")
+    image_properties = labels_response.get('ImageProperties', {})
+    foreground_brightness = int(image_properties.get('Foreground', {}).get('Quality', {}).get('Brightness', 0))
+    background_brightness = int(image_properties.get('Background', {}).get('Quality', {}).get('Brightness', 0))
+    return foreground_brightness, background_brightness
+
+def analyse_image(bucket: str, key: str, reference: Optional[dict]) -> dict:
+    LambdaMetrics.debug(f"Processing image: {key}")
+    with metrics.timer('AnalyseImage'):
+        image = load_image(bucket, key)
+        best_reference = None
+        if FACE_COLLECTION:
+            max_similarity, best_reference = search_face(image, key, FACE_COLLECTION)
+        else:
+            max_similarity = compare_face(image, key, reference)
+        foreground_brightness, background_brightness = detect_brightness(image, key)
+
+    item = {
+        'id': key,
+        'timestamp': datetime.utcnow().isoformat(),
+        'highestSimilarity': max_similarity,
+        'foregroundBrightness': foreground_brightness,
+        'backgroundBrightness': background_brightness,
+    }
+    if best_reference:
+        item['bestReference'] = best_reference
+    return item
+
+def alert_states(items: list) -> list:
+    # Only alerting rows carry alertState, so the index stays sparse. Indexing every row would put
+    # nearly all writes on one 'OK' partition, whose throttling would throttle the table as well
+    return ['ALERT' if matched else None for matched in AlertRules.active().match_items(items)]
+
+def upsert_result(item: dict) -> bool:
+    # Returns False when the stored row already holds these values and nothing was written
+    names = {'#id': 'id', '#ts': 'timestamp'}
+    values = {':ts': item['timestamp']}
+    sets = ['#ts = :ts']
+    removes = []
+    conditions = ['attribute_not_exists(#id)']
+
+    if RESULT_TTL_SECONDS:
+        names['#exp'] = 'expiresAt'
+        values[':exp'] = int(time.time()) + RESULT_TTL_SECONDS
+        sets.append('#exp = :exp')
+
+    for i, field in enumerate(COMPARED_FIELDS):
+        name, value = f"#f{i}", f":f{i}"
+        names[name] = field
+        if field in item:
+            values[value] = item[field]
+            sets.append(f"{name} = {value}")
+            conditions.append(f"attribute_not_exists({name}) OR {name} <> {value}")
+        else:
+            removes.append(name)
+            conditions.append(f"attribute_exists({name})")
+
+    update = "SET " + ", ".join(sets)
+    if removes:
+        update += " REMOVE " + ", ".join(removes)
+    try:
+        LambdaClients.table(TABLE_NAME).update_item(
+            Key={'id': item['id']},
+            UpdateExpression=update,
+            ConditionExpression=" OR ".join(conditions),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def process_batch(event: dict) -> dict:
+    SOURCE_IMAGE = os.environ.get('SOURCE_IMAGE', 'images/groupphoto.png')
+    failed_messages = []
+
+    # Work out which images each message refers to
+    records = []
+    with metrics.timer('SqsParse'):
+        for sqs_record in event.get('Records', []):
             try:
-                comp_response = rekognition_client.compare_faces(
-                    SourceImage={'S3Object': {'Bucket': bucket, 'Name': key}},
-                    TargetImage={'S3Object': {'Bucket': bucket, 'Name': SOURCE_IMAGE}},
-                    SimilarityThreshold=70
-                )
-                
-                # Get highest similarity
-                max_similarity = 0
-                for match in comp_response.get('FaceMatches', []):
-                    similarity = match.get('Similarity', 0)
-                    if similarity > max_similarity:
-                        max_similarity = int(similarity)
-
-                print(f"Comparison Response: {comp_response}\n Max Similarity: {max_similarity}")
+                for bucket, key, etag, event_name in parse_sqs_record(sqs_record, SOURCE_IMAGE):
+                    records.append((sqs_record['messageId'], bucket, key, etag, event_name))
             except Exception as e:
-                print(f"Error in face comparison for {key}: {str(e)}")
-                max_similarity = 0  # Default value on failure
-            
-            # Image Properties
+                print(f"Error processing SQS record: {str(e)}")
+                metrics.count('ParseErrors')
+                continue
+
+    # Reference photos update the collection before anything in this batch is scored against it
+    uploads = []
+    for message_id, bucket, key, etag, event_name in records:
+        if is_reference(key):
             try:
-                labels_response = rekognition_client.detect_labels(
-                    Image={'S3Object': {'Bucket': bucket, 'Name': key}},
-                    Features=['IMAGE_PROPERTIES'],
-                    Settings={'ImageProperties': {'MaxDominantColors': 20}}
-                )
-                
-                # Extract brightness values
-                print(f"Labels Response: {labels_response}")
-                image_properties = labels_response.get('ImageProperties', {})
-                foreground_brightness = int(image_properties.get('Foreground', {}).get('Quality', {}).get('Brightness', 0))
-                background_brightness = int(image_properties.get('Background', {}).get('Quality', {}).get('Brightness', 0))
-                
+                update_reference(bucket, key, etag, event_name)
             except Exception as e:
-                print(f"Error in image properties detection for {key}: {str(e)}")
-                foreground_brightness = 0
-                background_brightness = 0
-            
-            # Save to DynamoDB
+                print(f"Error updating reference {key}: {str(e)}")
+                failed_messages.append(message_id)
+        elif event_name.startswith('ObjectCreated'):
+            uploads.append((message_id, bucket, key, etag))
+
+    set_version = get_reference_set_version()
+    jobs = [(message_id, bucket, key, cache_key(etag, SOURCE_IMAGE, set_version) if etag and set_version is not None else None) for message_id, bucket, key, etag in uploads]
+    metrics.count('Messages', len(event.get('Records', [])))
+    metrics.count('Images', len(jobs))
+
+    # Images whose bytes were analysed before skip Rekognition entirely
+    with metrics.timer('CacheLookup'):
+        cached = get_cached_results(list({h for _, _, _, h in jobs if h}))
+    items = []
+    misses = []
+    for message_id, bucket, key, content_hash in jobs:
+        if content_hash in cached:
+            item = {'id': key, 'timestamp': datetime.utcnow().isoformat()}
+            item.update(cached[content_hash])
+            items.append((message_id, item))
+        else:
+            misses.append((message_id, bucket, key, content_hash))
+    print(f"Result cache: {len(jobs) - len(misses)} hits, {len(misses)} misses")
+    metrics.count('CacheHits', len(jobs) - len(misses))
+
+    # Run the Rekognition calls for the rest of the batch concurrently
+    new_results = {}
+    references = {}
+    if misses and not FACE_COLLECTION:
+        # The reference image is loaded once per bucket and shared by every comparison in the batch
+        for bucket in {bucket for _, bucket, _, _ in misses}:
             try:
-                item = {
-                    'id': key,
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'highestSimilarity': max_similarity,
-                    'foregroundBrightness': foreground_brightness,
-                    'backgroundBrightness': background_brightness,
-                }
-                
-                table.put_item(Item=item)
-                print(f"Saved results for {key} to DynamoDB")
-                
+                references[bucket] = load_reference(bucket, SOURCE_IMAGE)
             except Exception as e:
-                print(f"Failed to save results for {key}: {str(e)}")
-                
-        except Exception as e:
-            print(f"Error processing SQS record: {str(e)}")
-            continue
-    
+                print(f"Error loading reference image from {bucket}: {str(e)}")
+        failed_messages.extend(message_id for message_id, bucket, _, _ in misses if bucket not in references)
+        misses = [job for job in misses if job[1] in references]
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(misses))) as executor:
+            futures = [(message_id, key, content_hash, executor.submit(analyse_image, bucket, key, references.get(bucket))) for message_id, bucket, key, content_hash in misses]
+            for message_id, key, content_hash, future in futures:
+                try:
+                    item = future.result()
+                    items.append((message_id, item))
+                    if content_hash:
+                        new_results[content_hash] = item
+                except Exception as e:
+                    print(f"Error analysing {key}: {str(e)}")
+                    failed_messages.append(message_id)
+
+    # Conditional writes cannot be batched, so the upserts run concurrently instead
+    written = unchanged = 0
+    saved = set()
+    if items:
+        with metrics.timer('DynamoDBWrite'):
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(items))) as executor:
+                futures = []
+                for (message_id, item), state in zip(items, alert_states([item for _, item in items])):
+                    if state:
+                        item['alertState'] = state
+                    futures.append((message_id, item['id'], executor.submit(upsert_result, item)))
+                for message_id, key, future in futures:
+                    try:
+                        if future.result():
+                            written += 1
+                        else:
+                            unchanged += 1
+                        saved.add(key)
+                    except Exception as e:
+                        print(f"Failed to save result for {key} to DynamoDB: {str(e)}")
+                        failed_messages.append(message_id)
+    print(f"Saved results for {written} images to DynamoDB, {unchanged} unchanged")
+    metrics.count('ResultsWritten', written)
+    metrics.count('ResultsUnchanged', unchanged)
+
+    # A result whose write failed is not cached, its redelivered message is analysed again
+    with metrics.timer('CacheWrite'):
+        put_cached_results({content_hash: item for content_hash, item in new_results.items() if item['id'] in saved})
+
+    # Only the failed messages are returned to the queue
+    failed_messages = list(dict.fromkeys(failed_messages))
+    metrics.count('FailedMessages', len(failed_messages))
     return {
-        'statusCode': 200,
-        'body': json.dumps('Processing completed')
-    }
\ No newline at end of file
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_messages]
+    }
+
+def lambda_handler(event, context):
+    # Metrics are emitted even when the batch fails outright
+    try:
+        with metrics.timer('Handler'):
+            return process_batch(event)
+    finally:
+        metrics.flush()
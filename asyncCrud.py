@@ -0,0 +1,108 @@
+import asyncio, functools, inspect, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Awaitable, Dict, Any, Optional, Union
+import awsClients, awsWaiters, crudCFTemplate, crudDynamo, crudLambdaFunction, crudRekognition, crudS3
+
+# asyncio surface over the CRUD modules, so one event loop can drive many environments at once
+#   stack = await asyncCrud.cloudformation.find_stack(stack_name)
+#   await asyncCrud.dynamo.create_table(table_name, "id")
+# Each call runs the synchronous implementation on a shared executor, so behaviour is identical to the
+# blocking modules and clients stay pooled through awsClients. The waits defined here sleep on the
+# event loop instead of holding a thread, the ones inside a CRUD call still occupy its executor thread
+
+# Kept within the client connection pool so concurrent calls do not queue for a connection
+CONTROL_PLANE_THREADS = int(os.environ.get('FACE_CONTROL_PLANE_THREADS', str(awsClients.CLIENT_CONFIG.max_pool_connections)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CONTROL_PLANE_THREADS, thread_name_prefix='control-plane')
+        return _executor
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+async def run(func: Callable[..., Any], *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+class AsyncModule:
+    # Awaitable versions of a module's public functions, with the same names and arguments
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name: str):
+        target = getattr(self.module, name)
+        if name.startswith('_') or not inspect.isfunction(target):
+            return target
+
+        @functools.wraps(target)
+        async def call(*args, **kwargs):
+            return await run(target, *args, **kwargs)
+
+        setattr(self, name, call)
+        return call
+
+    def __dir__(self):
+        return [name for name, value in vars(self.module).items()
+                if inspect.isfunction(value) and value.__module__ == self.module.__name__ and not name.startswith('_')]
+
+cloudformation = AsyncModule(crudCFTemplate)
+dynamo = AsyncModule(crudDynamo)
+lambda_functions = AsyncModule(crudLambdaFunction)
+rekognition = AsyncModule(crudRekognition)
+s3 = AsyncModule(crudS3)
+
+async def poll(check: Callable[[], Any], description: str, timeout: float = 300,
+               initial_delay: float = 1, max_delay: float = 15) -> Any:
+    # Same contract and backoff as awsWaiters.poll, `check` runs on the executor between sleeps
+    start = time.monotonic()
+    deadline = start + timeout
+    attempt = 0
+
+    while True:
+        attempt += 1
+        try:
+            result = await run(check)
+        except Exception:
+            awsWaiters.record_wait(description, time.monotonic() - start, attempt, 'failed')
+            raise
+        if result is not None:
+            awsWaiters.record_wait(description, time.monotonic() - start, attempt, 'done')
+            return result
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            awsWaiters.record_wait(description, time.monotonic() - start, attempt, 'timeout')
+            raise awsWaiters.WaitTimeout(f"Timed out after {timeout}s waiting for {description}")
+        await asyncio.sleep(min(remaining, awsWaiters.backoff_delay(attempt - 1, initial_delay, max_delay)))
+
+async def boto_wait(client, waiter_name: str, description: Optional[str] = None, timeout: float = 600,
+                    initial_delay: float = 1, max_delay: float = 15, **kwargs) -> Any:
+    description = description or f"{waiter_name} {kwargs}"
+    check = awsWaiters.waiter_check(client, waiter_name, description, **kwargs)
+    return await poll(check, description, timeout=timeout, initial_delay=initial_delay, max_delay=max_delay)
+
+async def wait_all(waits: Dict[str, Union[Awaitable, Callable[[], Awaitable]]], limit: Optional[int] = None,
+                   return_exceptions: bool = False) -> Dict[str, Any]:
+    # Runs the waits concurrently, at most `limit` at a time, and returns their results by name.
+    # Passing factories rather than coroutines means waits over the limit do not start early
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def bounded(wait) -> Any:
+        if semaphore is None:
+            return await (wait() if callable(wait) else wait)
+        async with semaphore:
+            return await (wait() if callable(wait) else wait)
+
+    names = list(waits)
+    results = await asyncio.gather(*(bounded(waits[name]) for name in names), return_exceptions=return_exceptions)
+    return dict(zip(names, results))
@@ -0,0 +1,96 @@
+import boto3, threading
+from typing import Optional, Dict, Any
+from botocore.config import Config
+
+# One client per (service, region, profile), shared by every CRUD module and thread.
+# Building a client loads the service model, resolves credentials and opens a new
+# connection pool, so doing it on every call is far more expensive than the call itself
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    tcp_keepalive=True,
+    connect_timeout=10,
+    read_timeout=60
+)
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_resource_classes = {}
+_local = threading.local()
+_stats = {'Created': 0, 'Reused': 0}
+
+def get_session(profile: Optional[str] = None) -> boto3.session.Session:
+    with _lock:
+        if profile not in _sessions:
+            _sessions[profile] = boto3.session.Session(profile_name=profile)
+        return _sessions[profile]
+
+def get_client(service: str, region: Optional[str] = None, profile: Optional[str] = None):
+    return _cached_client((service, region, profile, 'client'))
+
+def _cached_client(key: tuple):
+    service, region, profile, _ = key
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _stats['Reused'] += 1
+            return client
+
+    # Clients are thread-safe once built, but building one from a shared session is not
+    session = get_session(profile)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = session.client(service, region_name=region, config=CLIENT_CONFIG)
+            _stats['Created'] += 1
+        else:
+            _stats['Reused'] += 1
+        return _clients[key]
+
+def get_resource(service: str, region: Optional[str] = None, profile: Optional[str] = None):
+    # boto3 resources are not thread-safe, so each thread gets its own, built on the shared client
+    key = (service, region, profile)
+    resources = getattr(_local, 'resources', None)
+    if resources is None:
+        resources = _local.resources = {}
+    if key in resources:
+        with _lock:
+            _stats['Reused'] += 1
+        return resources[key]
+
+    resource_class, client = _resource_class(key)
+    resources[key] = resource_class(client=client)
+    return resources[key]
+
+def _resource_class(key: tuple) -> tuple:
+    # Resources register their own serialisation hooks on the client they use, so they share a
+    # separate pooled client rather than the plain one other modules expect raw responses from.
+    # Only the first resource is built by the session, later ones reuse its class and client
+    service, region, profile = key
+    session = get_session(profile)
+    with _lock:
+        if key not in _resource_classes:
+            resource = session.resource(service, region_name=region, config=CLIENT_CONFIG)
+            _resource_classes[key] = type(resource)
+            _clients[key + ('resource',)] = resource.meta.client
+            _stats['Created'] += 1
+        else:
+            _stats['Reused'] += 1
+        return _resource_classes[key], _clients[key + ('resource',)]
+
+def get_region(profile: Optional[str] = None) -> str:
+    return get_session(profile).region_name
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        return dict(_stats, Clients=len(_clients))
+
+def reset() -> None:
+    # Drop every cached session and client, e.g. after credentials change
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
+        _resource_classes.clear()
+        _stats.update({'Created': 0, 'Reused': 0})
+    _local.__dict__.clear()
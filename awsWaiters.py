@@ -0,0 +1,103 @@
+import random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional
+from botocore.exceptions import ClientError
+from botocore import xform_name
+
+# Shared polling for every CRUD module: jittered exponential backoff, an overall deadline,
+# and a record of how long each wait actually took
+
+class WaitFailed(Exception):
+    pass
+
+class WaitTimeout(TimeoutError):
+    pass
+
+_timings = []
+_timings_lock = threading.Lock()
+
+def record_wait(description: str, seconds: float, attempts: int, outcome: str) -> None:
+    with _timings_lock:
+        _timings.append({'Description': description, 'Seconds': seconds, 'Attempts': attempts, 'Outcome': outcome})
+
+def get_wait_timings() -> List[Dict[str, Any]]:
+    with _timings_lock:
+        return list(_timings)
+
+def print_wait_timings() -> None:
+    timings = get_wait_timings()
+    if not timings:
+        return
+    print(f"\nWaited {sum(t['Seconds'] for t in timings):.1f}s across {len(timings)} waits")
+    for t in sorted(timings, key=lambda t: t['Seconds'], reverse=True):
+        print(f"  {t['Description']:<60} {t['Seconds']:6.1f}s  {t['Attempts']:3} polls  {t['Outcome']}")
+
+def backoff_delay(attempt: int, initial_delay: float, max_delay: float) -> float:
+    # Equal jitter: half the delay is fixed, half is random, so polls spread out but still back off
+    delay = min(max_delay, initial_delay * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
+def poll(check: Callable[[], Any], description: str, timeout: float = 300,
+         initial_delay: float = 1, max_delay: float = 15) -> Any:
+    # `check` returns None to keep waiting, anything else to finish, or raises to fail
+    start = time.monotonic()
+    deadline = start + timeout
+    attempt = 0
+
+    while True:
+        attempt += 1
+        try:
+            result = check()
+        except Exception:
+            record_wait(description, time.monotonic() - start, attempt, 'failed')
+            raise
+        if result is not None:
+            record_wait(description, time.monotonic() - start, attempt, 'done')
+            return result
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            record_wait(description, time.monotonic() - start, attempt, 'timeout')
+            raise WaitTimeout(f"Timed out after {timeout}s waiting for {description}")
+        time.sleep(min(remaining, backoff_delay(attempt - 1, initial_delay, max_delay)))
+
+def waiter_check(client, waiter_name: str, description: str, **kwargs) -> Callable[[], Any]:
+    # A poll check that evaluates a botocore waiter's own acceptors
+    config = client.get_waiter(waiter_name).config
+    operation = getattr(client, xform_name(config.operation))
+
+    def check():
+        try:
+            response = operation(**kwargs)
+        except ClientError as e:
+            response = e.response
+
+        for acceptor in config.acceptors:
+            if acceptor.matcher_func(response):
+                if acceptor.state == 'success':
+                    return response
+                if acceptor.state == 'failure':
+                    raise WaitFailed(f"{description} reached a failure state")
+                return None
+
+        # Errors no acceptor expects are not going to resolve by waiting
+        if 'Error' in response:
+            raise ClientError(response, config.operation)
+        return None
+
+    return check
+
+def boto_wait(client, waiter_name: str, description: Optional[str] = None, timeout: float = 600,
+              initial_delay: float = 1, max_delay: float = 15, **kwargs) -> Any:
+    # Uses the waiter's acceptors, but with our backoff instead of its fixed delay
+    description = description or f"{waiter_name} {kwargs}"
+    check = waiter_check(client, waiter_name, description, **kwargs)
+    return poll(check, description, timeout=timeout, initial_delay=initial_delay, max_delay=max_delay)
+
+def wait_all(waits: Dict[str, Callable[[], Any]], max_workers: Optional[int] = None) -> Dict[str, Any]:
+    # Run several waits at once, the total time is the slowest one rather than the sum
+    if not waits:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(waits)) as executor:
+        futures = {name: executor.submit(wait) for name, wait in waits.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -1,9 +1,10 @@
-import boto3, os
+import os, time
+import awsClients, awsWaiters
 from typing import Optional, Dict, Any
 from botocore.exceptions import ClientError
 
 def create_stack(stack_name: str, template_path: str, parameters: list) -> Dict[str, Any]:
-    cf_client = boto3.client('cloudformation')
+    cf_client = awsClients.get_client('cloudformation')
     
     # Validate and read template
     if not os.path.exists(template_path):
@@ -24,8 +25,7 @@ def create_stack(stack_name: str, template_path: str, parameters: list) -> Dict[
         print(f"Creating CloudFormation Stack {stack_name}")
         
         response = cf_client.create_stack(**create_args)
-        waiter = cf_client.get_waiter('stack_create_complete')
-        waiter.wait(StackName=stack_name)
+        awsWaiters.boto_wait(cf_client, 'stack_create_complete', f"stack {stack_name} created", timeout=1800, StackName=stack_name)
         
         # Return full stack details
         print(f"Stack creation completed. Status: {response}")
@@ -38,14 +38,64 @@ def create_stack(stack_name: str, template_path: str, parameters: list) -> Dict[
             print(f"Error creating Stack: {stack_name}")
             raise
 
+def update_stack(stack_name: str, template_path: str, parameters: list) -> Dict[str, Any]:
+    cf_client = awsClients.get_client('cloudformation')
+    
+    # Validate and read template
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Template file {template_path} not found")
+    
+    with open(template_path, 'r') as file:
+        template_body = file.read()
+    
+    # Changes are previewed through a change set so an unchanged stack is left alone
+    change_set_name = f"update-{int(time.time())}"
+    change_set_args = {
+        'StackName': stack_name,
+        'ChangeSetName': change_set_name,
+        'ChangeSetType': 'UPDATE',
+        'TemplateBody': template_body,
+        'Capabilities': ['CAPABILITY_IAM'],
+        'Parameters': parameters
+    }
+    
+    try:
+        print(f"Creating change set for CloudFormation Stack {stack_name}")
+        cf_client.create_change_set(**change_set_args)
+        
+        try:
+            awsWaiters.boto_wait(cf_client, 'change_set_create_complete', f"change set for {stack_name} created",
+                                 StackName=stack_name, ChangeSetName=change_set_name)
+        except awsWaiters.WaitFailed:
+            change_set = cf_client.describe_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+            reason = change_set.get('StatusReason', '')
+            if "didn't contain changes" in reason or 'No updates' in reason:
+                cf_client.delete_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+                print(f"Stack {stack_name} is up to date")
+                return find_stack(stack_name)
+            raise RuntimeError(f"Change set for {stack_name} failed: {reason}")
+        
+        print(f"Applying change set to Stack {stack_name}")
+        cf_client.execute_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+        awsWaiters.boto_wait(cf_client, 'stack_update_complete', f"stack {stack_name} updated", timeout=1800, StackName=stack_name)
+        
+        print(f"Stack {stack_name} updated successfully")
+        return find_stack(stack_name)
+        
+    except ClientError as e:
+        if 'No updates are to be performed' in e.response['Error']['Message']:
+            print(f"Stack {stack_name} is up to date")
+            return find_stack(stack_name)
+        print(f"Error updating Stack: {stack_name}")
+        raise
+
 def delete_stack(stack_name: str) -> None:
-    cf_client = boto3.client('cloudformation')
+    cf_client = awsClients.get_client('cloudformation')
     
     try:
         print(f"Deleting existing CloudFormation Stack {stack_name}")
         cf_client.delete_stack(StackName=stack_name)
-        waiter = cf_client.get_waiter('stack_delete_complete')
-        waiter.wait(StackName=stack_name)
+        awsWaiters.boto_wait(cf_client, 'stack_delete_complete', f"stack {stack_name} deleted", timeout=1800, StackName=stack_name)
         print(f"Stack {stack_name} deleted successfully")
         
     except ClientError as e:
@@ -56,7 +106,7 @@ def delete_stack(stack_name: str) -> None:
             raise
 
 def find_stack(stack_name: str) -> Optional[dict]:
-    cf_client = boto3.client('cloudformation')
+    cf_client = awsClients.get_client('cloudformation')
     try:
         response = cf_client.describe_stacks(StackName=stack_name)
         print(f"Found {stack_name}")
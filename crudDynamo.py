@@ -1,36 +1,133 @@
-import boto3
-from typing import Optional, Dict, Any
+import csv, json, queue, threading
+import awsClients, awsWaiters
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, Iterable, Iterator
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
 
-def create_table(table_name: str, partition_key: str) -> dict:
-    dynamodb = boto3.resource('dynamodb')
-    
-    # Setting the 
+# Parquet export is optional, the other formats only need the standard library
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+# Secondary indexes are described as {'name', 'partition_key', 'sort_key' (optional), 'projection' (optional)}
+# where projection is 'ALL' (default), 'KEYS_ONLY' or a list of extra attributes to include.
+# Autoscaling is {'min_capacity', 'max_capacity', 'target_utilisation'} and only applies to provisioned tables
+
+def _key_definitions(partition_key: str, sort_key: Optional[str]) -> tuple:
     key_schema = [{'AttributeName': partition_key, 'KeyType': 'HASH'}]
     attribute_defs = [{'AttributeName': partition_key, 'AttributeType': 'S'}]
+    if sort_key:
+        key_schema.append({'AttributeName': sort_key, 'KeyType': 'RANGE'})
+        attribute_defs.append({'AttributeName': sort_key, 'AttributeType': 'S'})
+    return key_schema, attribute_defs
+
+def _throughput(read_capacity: int, write_capacity: int) -> dict:
+    return {'ReadCapacityUnits': read_capacity, 'WriteCapacityUnits': write_capacity}
+
+def _index_definition(index: Dict[str, Any], billing_mode: str, read_capacity: int, write_capacity: int) -> tuple:
+    key_schema, attribute_defs = _key_definitions(index['partition_key'], index.get('sort_key'))
+    projection = index.get('projection', 'ALL')
+    if isinstance(projection, list):
+        projection = {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': projection}
+    else:
+        projection = {'ProjectionType': projection}
+
+    definition = {'IndexName': index['name'], 'KeySchema': key_schema, 'Projection': projection}
+    if billing_mode == 'PROVISIONED':
+        definition['ProvisionedThroughput'] = _throughput(read_capacity, write_capacity)
+    return definition, attribute_defs
+
+def wait_for_table_active(table_name: str, timeout: float = 1800) -> dict:
+    # New indexes are backfilled after the table itself is active again, so both are checked
+    dynamodb = awsClients.get_client('dynamodb')
+    def check():
+        table = dynamodb.describe_table(TableName=table_name)['Table']
+        indexes = table.get('GlobalSecondaryIndexes', [])
+        if table['TableStatus'] == 'ACTIVE' and all(i['IndexStatus'] == 'ACTIVE' for i in indexes):
+            return table
+        return None
+    return awsWaiters.poll(check, f"table {table_name} and indexes active", timeout=timeout, max_delay=30)
+
+def configure_autoscaling(table_name: str, index_names: List[str], min_capacity: int, max_capacity: int, target_utilisation: float = 70) -> None:
+    autoscaling = awsClients.get_client('application-autoscaling')
+    resources = [('table', f"table/{table_name}")] + [('index', f"table/{table_name}/index/{name}") for name in index_names]
+    metrics = {'ReadCapacityUnits': 'DynamoDBReadCapacityUtilization', 'WriteCapacityUnits': 'DynamoDBWriteCapacityUtilization'}
+
+    # Capacity tracks utilisation, so bursts scale up instead of being throttled at a fixed 5/5
+    for resource_type, resource_id in resources:
+        for dimension, metric in metrics.items():
+            scalable_dimension = f"dynamodb:{resource_type}:{dimension}"
+            autoscaling.register_scalable_target(
+                ServiceNamespace='dynamodb',
+                ResourceId=resource_id,
+                ScalableDimension=scalable_dimension,
+                MinCapacity=min_capacity,
+                MaxCapacity=max_capacity
+            )
+            autoscaling.put_scaling_policy(
+                PolicyName=f"{resource_id.replace('/', '-')}-{dimension}",
+                ServiceNamespace='dynamodb',
+                ResourceId=resource_id,
+                ScalableDimension=scalable_dimension,
+                PolicyType='TargetTrackingScaling',
+                TargetTrackingScalingPolicyConfiguration={
+                    'TargetValue': float(target_utilisation),
+                    'PredefinedMetricSpecification': {'PredefinedMetricType': metric}
+                }
+            )
+    print(f"Autoscaling {table_name} between {min_capacity} and {max_capacity} capacity units")
+
+def create_table(table_name: str, partition_key: str, stream: bool = True, ttl_attribute: Optional[str] = None, sort_key: Optional[str] = None,
+                 billing_mode: str = 'PROVISIONED', read_capacity: int = 5, write_capacity: int = 5,
+                 indexes: Optional[List[Dict[str, Any]]] = None, autoscaling: Optional[Dict[str, Any]] = None) -> dict:
+    dynamodb = awsClients.get_resource('dynamodb')
+    
+    # Setting the table and index keys, every key attribute is a string
+    key_schema, attribute_defs = _key_definitions(partition_key, sort_key)
     
     # Parameters for table creation and enabling email notifications 
     params = {
         'TableName': table_name,
         'KeySchema': key_schema,
         'AttributeDefinitions': attribute_defs,
-        'ProvisionedThroughput': {
-            'ReadCapacityUnits': 5,
-            'WriteCapacityUnits': 5
-        },
-        'StreamSpecification': {
+        'BillingMode': billing_mode
+    }
+    if billing_mode == 'PROVISIONED':
+        params['ProvisionedThroughput'] = _throughput(read_capacity, write_capacity)
+    if indexes:
+        params['GlobalSecondaryIndexes'] = []
+        for index in indexes:
+            definition, index_attributes = _index_definition(index, billing_mode, read_capacity, write_capacity)
+            params['GlobalSecondaryIndexes'].append(definition)
+            attribute_defs.extend(a for a in index_attributes if a not in attribute_defs)
+    if stream:
+        params['StreamSpecification'] = {
             'StreamEnabled': True,
             'StreamViewType': 'NEW_IMAGE'
         }
-    }
     
     try:
         print(f"Creating DynamoDB Table {table_name}")
         table = dynamodb.create_table(**params)
         
         # Refresh table attributes to get stream ARN
-        table.wait_until_exists()
+        awsWaiters.boto_wait(dynamodb.meta.client, 'table_exists', f"table {table_name} active", TableName=table_name)
+        if indexes:
+            wait_for_table_active(table_name)
         table.load()
+
+        # Expire items automatically once the TTL attribute has passed
+        if ttl_attribute:
+            dynamodb.meta.client.update_time_to_live(
+                TableName=table_name,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': ttl_attribute}
+            )
+        if autoscaling and billing_mode == 'PROVISIONED':
+            configure_autoscaling(table_name, [i['name'] for i in indexes or []], **autoscaling)
         print(f"Table '{table_name}' created successfully")
         return {
             'TableArn': table.table_arn,
@@ -43,8 +140,65 @@ def create_table(table_name: str, partition_key: str) -> dict:
             print(f"Error creating table: {e.response['Error']['Message']}")
         raise
 
+def update_table(table_name: str, billing_mode: str = 'PROVISIONED', read_capacity: int = 5, write_capacity: int = 5,
+                 indexes: Optional[List[Dict[str, Any]]] = None, autoscaling: Optional[Dict[str, Any]] = None,
+                 ttl_attribute: Optional[str] = None, existing: Optional[dict] = None) -> Dict[str, Any]:
+    # Brings an existing table's capacity mode, indexes and TTL in line without recreating it
+    dynamodb = awsClients.get_client('dynamodb')
+    table = existing or dynamodb.describe_table(TableName=table_name)['Table']
+    changes = {'BillingModeUpdated': False, 'IndexesCreated': [], 'TTLEnabled': False}
+
+    try:
+        current_mode = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+        if current_mode != billing_mode:
+            print(f"Switching {table_name} from {current_mode} to {billing_mode}")
+            params = {'TableName': table_name, 'BillingMode': billing_mode}
+            if billing_mode == 'PROVISIONED':
+                params['ProvisionedThroughput'] = _throughput(read_capacity, write_capacity)
+                params['GlobalSecondaryIndexUpdates'] = [
+                    {'Update': {'IndexName': i['IndexName'], 'ProvisionedThroughput': _throughput(read_capacity, write_capacity)}}
+                    for i in table.get('GlobalSecondaryIndexes', [])
+                ]
+            dynamodb.update_table(**params)
+            wait_for_table_active(table_name)
+            changes['BillingModeUpdated'] = True
+
+        # DynamoDB only allows one new index per update
+        existing_indexes = {i['IndexName'] for i in table.get('GlobalSecondaryIndexes', [])}
+        for index in indexes or []:
+            if index['name'] in existing_indexes:
+                continue
+            print(f"Creating index {index['name']} on {table_name}")
+            definition, attribute_defs = _index_definition(index, billing_mode, read_capacity, write_capacity)
+            dynamodb.update_table(
+                TableName=table_name,
+                AttributeDefinitions=attribute_defs,
+                GlobalSecondaryIndexUpdates=[{'Create': definition}]
+            )
+            wait_for_table_active(table_name)
+            changes['IndexesCreated'].append(index['name'])
+
+        if ttl_attribute:
+            ttl = dynamodb.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+            if ttl.get('TimeToLiveStatus') not in ['ENABLED', 'ENABLING'] or ttl.get('AttributeName') != ttl_attribute:
+                dynamodb.update_time_to_live(
+                    TableName=table_name,
+                    TimeToLiveSpecification={'Enabled': True, 'AttributeName': ttl_attribute}
+                )
+                changes['TTLEnabled'] = True
+
+        if autoscaling and billing_mode == 'PROVISIONED':
+            configure_autoscaling(table_name, [i['name'] for i in indexes or []], **autoscaling)
+
+        if not any(changes.values()):
+            print(f"Table '{table_name}' is up to date")
+        return changes
+    except ClientError as e:
+        print(f"Error updating table: {e.response['Error']['Message']}")
+        raise
+
 def find_table(table_name: str) -> Optional[dict]:
-    dynamodb = boto3.client('dynamodb')
+    dynamodb = awsClients.get_client('dynamodb')
     try:
         response = dynamodb.describe_table(TableName=table_name)
         print(f"Found {table_name}")
@@ -56,7 +210,7 @@ def find_table(table_name: str) -> Optional[dict]:
         raise
 
 def delete_table(table_name: str) -> dict:
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = awsClients.get_resource('dynamodb')
     table = dynamodb.Table(table_name)
     
     try:
@@ -64,7 +218,7 @@ def delete_table(table_name: str) -> dict:
         response = table.delete()
         
         # Wait for deletion to complete
-        table.wait_until_not_exists()
+        awsWaiters.boto_wait(dynamodb.meta.client, 'table_not_exists', f"table {table_name} deleted", TableName=table_name)
         print(f"Table '{table_name}' deleted successfully")
         return { 'TableStatus': 'DELETED' }
     except ClientError as e:
@@ -75,7 +229,7 @@ def delete_table(table_name: str) -> dict:
         raise
     
 def find_tables() -> list:
-    dynamodb = boto3.client('dynamodb')
+    dynamodb = awsClients.get_client('dynamodb')
     tables = []
     paginator = dynamodb.get_paginator('list_tables')
     
@@ -85,4 +239,148 @@ def find_tables() -> list:
         return tables
     except Exception as e:
         print(f"Error retrieving tables: {str(e)}")
-        return []
\ No newline at end of file
+        return []
+
+def plain_item(item: dict) -> dict:
+    # DynamoDB numbers come back as Decimal, which neither json nor pyarrow accept
+    def convert(value):
+        if isinstance(value, Decimal):
+            return int(value) if value == value.to_integral_value() else float(value)
+        if isinstance(value, dict):
+            return {k: convert(v) for k, v in value.items()}
+        if isinstance(value, (list, set)):
+            return [convert(v) for v in value]
+        return value
+    return {k: convert(v) for k, v in item.items()}
+
+def scan_items(table_name: str, total_segments: int = 8, max_workers: Optional[int] = None, **scan_kwargs) -> Iterator[dict]:
+    # Segments are scanned in parallel, pages are handed over through a bounded queue so memory stays flat
+    dynamodb = awsClients.get_client('dynamodb')
+    deserializer = TypeDeserializer()
+    pages = queue.Queue(maxsize=(max_workers or total_segments) * 2)
+    segments = queue.Queue()
+    for segment in range(total_segments):
+        segments.put(segment)
+    stop = threading.Event()
+    done = object()
+
+    def worker():
+        try:
+            while not stop.is_set():
+                try:
+                    segment = segments.get_nowait()
+                except queue.Empty:
+                    return
+                paginator = dynamodb.get_paginator('scan')
+                for page in paginator.paginate(TableName=table_name, Segment=segment, TotalSegments=total_segments, **scan_kwargs):
+                    if stop.is_set():
+                        return
+                    pages.put(page.get('Items', []))
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(done)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(min(max_workers or total_segments, total_segments))]
+    for thread in workers:
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < len(workers):
+            page = pages.get()
+            if page is done:
+                finished += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                for item in page:
+                    yield {k: deserializer.deserialize(v) for k, v in item.items()}
+    finally:
+        # Let blocked workers finish if the caller stops early
+        stop.set()
+        while any(thread.is_alive() for thread in workers):
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def query_items(table_name: str, key_condition, index_name: Optional[str] = None, **query_kwargs) -> Iterator[dict]:
+    table = awsClients.get_resource('dynamodb').Table(table_name)
+    params = dict(query_kwargs, KeyConditionExpression=key_condition)
+    if index_name:
+        params['IndexName'] = index_name
+
+    while True:
+        response = table.query(**params)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def query_by_alert_state(table_name: str, since: Optional[str] = None, until: Optional[str] = None,
+                         index_name: str = 'byAlertState', newest_first: bool = False) -> Iterator[dict]:
+    # The index is sparse, only alerting rows have alertState. Timestamps are ISO strings, so a
+    # string range on the sort key is a time range
+    condition = Key('alertState').eq('ALERT')
+    if since and until:
+        condition = condition & Key('timestamp').between(since, until)
+    elif since:
+        condition = condition & Key('timestamp').gte(since)
+    elif until:
+        condition = condition & Key('timestamp').lte(until)
+    return query_items(table_name, condition, index_name=index_name, ScanIndexForward=not newest_first)
+
+def _chunks(items: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for item in items:
+        chunk.append(plain_item(item))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def export_items(items: Iterable[dict], path: str, file_format: str = 'jsonl', fields: Optional[List[str]] = None, chunk_rows: int = 10000) -> int:
+    # Rows are written one chunk at a time, CSV and Parquet columns come from `fields` or the first chunk
+    if file_format not in ['jsonl', 'csv', 'parquet']:
+        raise ValueError(f"Unsupported export format {file_format}, expected jsonl, csv or parquet")
+    if file_format == 'parquet' and pyarrow is None:
+        raise ImportError("Parquet export needs pyarrow, install it or export as csv or jsonl")
+
+    rows = 0
+    writer = None
+    with open(path, 'w' if file_format != 'parquet' else 'wb', **({'newline': ''} if file_format == 'csv' else {})) as f:
+        try:
+            for chunk in _chunks(items, chunk_rows):
+                if fields is None:
+                    fields = sorted({k for row in chunk for k in row})
+
+                if file_format == 'jsonl':
+                    f.write(''.join(json.dumps(row) + '\n' for row in chunk))
+                elif file_format == 'csv':
+                    if writer is None:
+                        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+                        writer.writeheader()
+                    writer.writerows(chunk)
+                else:
+                    columns = {field: [row.get(field) for row in chunk] for field in fields}
+                    if writer is None:
+                        # Columns with no values yet would be typed null and reject later chunks
+                        batch = pyarrow.table(columns)
+                        schema = pyarrow.schema([
+                            field.with_type(pyarrow.string()) if pyarrow.types.is_null(field.type) else field
+                            for field in batch.schema
+                        ])
+                        batch = batch.cast(schema)
+                        writer = pq.ParquetWriter(f, schema)
+                    else:
+                        batch = pyarrow.table(columns, schema=writer.schema)
+                    writer.write_table(batch)
+                rows += len(chunk)
+        finally:
+            if file_format == 'parquet' and writer is not None:
+                writer.close()
+
+    print(f"Exported {rows} rows to {path}")
+    return rows
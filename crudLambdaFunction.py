@@ -1,19 +1,53 @@
-import os, tempfile, boto3, zipfile, time
+import json
+import awsClients, awsWaiters, crudS3, lambdaArtifacts
 from typing import Dict, Optional, List
 from botocore.exceptions import ClientError
 
+FUNCTION_TIMEOUT = 60
+FUNCTION_MEMORY = 128
 
-def create_lambda_function(function_name: str, code_path: str, role_arn: str, handler: str, runtime: str, environment: dict) -> dict:
-    lambda_client = boto3.client('lambda')
+# Provisioned concurrency and SnapStart only apply to published versions, invoked through this alias
+LIVE_ALIAS = 'live'
+
+# Largest zip Lambda accepts inline, bigger packages are deployed from S3
+INLINE_CODE_LIMIT = 50 * 1024 * 1024
+
+# With an artifact bucket only packages up to this size are read into memory, anything bigger is streamed to S3
+STREAMED_CODE_THRESHOLD = 4 * 1024 * 1024
+
+def code_location(function_name: str, artifact: dict, artifact_bucket: Optional[str] = None) -> dict:
+    # Small packages are sent inline, larger ones are uploaded once per content hash and referenced from S3
+    inline_limit = STREAMED_CODE_THRESHOLD if artifact_bucket else INLINE_CODE_LIMIT
+    if artifact['Size'] <= inline_limit:
+        with open(artifact['Path'], 'rb') as f:
+            return {'ZipFile': f.read()}
+    if not artifact_bucket:
+        raise ValueError(f"Package for {function_name} is {artifact['Size']} bytes, above the inline limit, an artifact bucket is required")
     
-    # Package code
-    with tempfile.TemporaryDirectory() as tmpdir:
-        zip_path = os.path.join(tmpdir, 'lambda.zip')
-        with zipfile.ZipFile(zip_path, 'w') as zf:
-            zf.write(code_path, arcname=os.path.basename(code_path))
-        
-        with open(zip_path, 'rb') as f:
-            code_bytes = f.read()
+    s3_client = awsClients.get_client('s3')
+    key = f"lambda/{function_name}/{artifact['SourceHash']}.zip"
+    crudS3.ensure_bucket(artifact_bucket)
+    try:
+        s3_client.head_object(Bucket=artifact_bucket, Key=key)
+        print(f"Package for {function_name} is already in s3://{artifact_bucket}/{key}")
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ['404', 'NoSuchKey']:
+            raise
+        # Streamed from disk as a multipart upload
+        print(f"Uploading package for {function_name} to s3://{artifact_bucket}/{key}")
+        s3_client.upload_file(artifact['Path'], artifact_bucket, key)
+    return {'S3Bucket': artifact_bucket, 'S3Key': key}
+
+def snap_start_setting(snap_start: bool) -> dict:
+    return {'ApplyOn': 'PublishedVersions' if snap_start else 'None'}
+
+def create_lambda_function(function_name: str, code_path: str, role_arn: str, handler: str, runtime: str, environment: dict, layers: Optional[List[str]] = None, extra_files: Optional[List[str]] = None,
+                           memory_size: int = FUNCTION_MEMORY, architecture: str = 'x86_64', snap_start: bool = False,
+                           package_dirs: Optional[List[str]] = None, artifact_bucket: Optional[str] = None) -> dict:
+    lambda_client = awsClients.get_client('lambda')
+    
+    # Package the handler with the local modules it imports
+    artifact = lambdaArtifacts.build_artifact(code_path, extra_files, package_dirs)
     
     try:
         response = lambda_client.create_function(
@@ -21,15 +55,18 @@ def create_lambda_function(function_name: str, code_path: str, role_arn: str, ha
             Runtime=runtime,
             Role=role_arn,
             Handler=handler,
-            Code={'ZipFile': code_bytes},
-            Timeout=60,
+            Code=code_location(function_name, artifact, artifact_bucket),
+            Timeout=FUNCTION_TIMEOUT,
+            MemorySize=memory_size,
+            Architectures=[architecture],
+            SnapStart=snap_start_setting(snap_start),
             Publish=True,
-            Environment={'Variables': environment}
+            Environment={'Variables': environment},
+            Layers=layers or []
         )
         
         # Wait until function is active
-        waiter = lambda_client.get_waiter('function_active')
-        waiter.wait(FunctionName=function_name)
+        awsWaiters.boto_wait(lambda_client, 'function_active', f"function {function_name} active", FunctionName=function_name)
         
         print(f"Created Lambda Function {function_name}")
         return response
@@ -41,34 +78,210 @@ def create_lambda_function(function_name: str, code_path: str, role_arn: str, ha
             print(f"Error creating Lambda Function {function_name}: {e}")
             raise
 
-def delete_lambda_function(function_name: str) -> None:
-    lambda_client = boto3.client('lambda')
+def update_lambda_function(function_name: str, code_path: str, role_arn: str, handler: str, runtime: str, environment: dict, layers: Optional[List[str]] = None, extra_files: Optional[List[str]] = None,
+                           memory_size: int = FUNCTION_MEMORY, architecture: str = 'x86_64', snap_start: bool = False,
+                           package_dirs: Optional[List[str]] = None, artifact_bucket: Optional[str] = None, existing: Optional[dict] = None) -> Dict[str, bool]:
+    lambda_client = awsClients.get_client('lambda')
+    if existing is None:
+        existing = lambda_client.get_function(FunctionName=function_name)
+    config = existing['Configuration']
+    changes = {'CodeUpdated': False, 'ConfigurationUpdated': False}
     
-    # Remove all event source mappings
     try:
-        print(f"Deleting {function_name} source mappings")
-        mappings = lambda_client.list_event_source_mappings(
-            FunctionName=function_name
-        )
-        for mapping in mappings['EventSourceMappings']:
-            lambda_client.delete_event_source_mapping(UUID=mapping['UUID'])
-    except ClientError:
-        pass
+        # Only upload and push code when the package hash differs from what is deployed, the architecture can only change with it
+        artifact = lambdaArtifacts.build_artifact(code_path, extra_files, package_dirs)
+        if artifact['CodeSha256'] != config['CodeSha256'] or config.get('Architectures', ['x86_64']) != [architecture]:
+            print(f"Updating code for Lambda Function {function_name}")
+            location = code_location(function_name, artifact, artifact_bucket)
+            lambda_client.update_function_code(FunctionName=function_name, Architectures=[architecture], Publish=True, **location)
+            awsWaiters.boto_wait(lambda_client, 'function_updated', f"function {function_name} code update", FunctionName=function_name)
+            changes['CodeUpdated'] = True
+        
+        desired = {
+            'Role': role_arn,
+            'Handler': handler,
+            'Runtime': runtime,
+            'Timeout': FUNCTION_TIMEOUT,
+            'MemorySize': memory_size,
+            'SnapStart': snap_start_setting(snap_start),
+            'Environment': {'Variables': environment},
+            'Layers': layers or []
+        }
+        current = {
+            'Role': config.get('Role'),
+            'Handler': config.get('Handler'),
+            'Runtime': config.get('Runtime'),
+            'Timeout': config.get('Timeout'),
+            'MemorySize': config.get('MemorySize'),
+            'SnapStart': {'ApplyOn': config.get('SnapStart', {}).get('ApplyOn', 'None')},
+            'Environment': {'Variables': config.get('Environment', {}).get('Variables', {})},
+            'Layers': [layer['Arn'] for layer in config.get('Layers', [])]
+        }
+        if desired != current:
+            print(f"Updating configuration for Lambda Function {function_name}")
+            lambda_client.update_function_configuration(FunctionName=function_name, **desired)
+            awsWaiters.boto_wait(lambda_client, 'function_updated', f"function {function_name} configuration update", FunctionName=function_name)
+            changes['ConfigurationUpdated'] = True
+        
+        if not any(changes.values()):
+            print(f"Lambda Function {function_name} is up to date")
+        return changes
+    
+    except ClientError as e:
+        print(f"Error updating Lambda Function {function_name}: {e}")
+        raise
+
+def publish_alias(function_name: str, provisioned_concurrency: Optional[int] = None, alias: str = LIVE_ALIAS) -> str:
+    # Publishes the current code and configuration and points the alias at it, returns the alias ARN
+    lambda_client = awsClients.get_client('lambda')
+    
+    try:
+        # Nothing new is published when nothing changed since the last version
+        awsWaiters.boto_wait(lambda_client, 'function_updated', f"function {function_name} updated", FunctionName=function_name)
+        version = lambda_client.publish_version(FunctionName=function_name)['Version']
+        
+        # With SnapStart the version only becomes active once its snapshot is taken
+        awsWaiters.boto_wait(lambda_client, 'published_version_active', f"function {function_name} version {version} active", FunctionName=function_name, Qualifier=version)
+        
+        response = find_alias(function_name, alias)
+        if response is None:
+            print(f"Creating alias {alias} of {function_name} at version {version}")
+            response = lambda_client.create_alias(FunctionName=function_name, Name=alias, FunctionVersion=version)
+        elif response['FunctionVersion'] != version:
+            print(f"Pointing alias {alias} of {function_name} at version {version}")
+            response = lambda_client.update_alias(FunctionName=function_name, Name=alias, FunctionVersion=version)
+    
+    except ClientError as e:
+        print(f"Error publishing Lambda Function {function_name}: {e}")
+        raise
+    
+    set_provisioned_concurrency(function_name, alias, provisioned_concurrency)
+    return response['AliasArn']
+
+def find_alias(function_name: str, alias: str = LIVE_ALIAS) -> Optional[dict]:
+    lambda_client = awsClients.get_client('lambda')
+    try:
+        return lambda_client.get_alias(FunctionName=function_name, Name=alias)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
+
+def set_provisioned_concurrency(function_name: str, qualifier: str, provisioned_concurrency: Optional[int], timeout: float = 900) -> None:
+    # Keeps execution environments initialised ahead of requests, None removes them so they stop being billed
+    lambda_client = awsClients.get_client('lambda')
+    
+    def current_config() -> Optional[dict]:
+        try:
+            return lambda_client.get_provisioned_concurrency_config(FunctionName=function_name, Qualifier=qualifier)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['ProvisionedConcurrencyConfigNotFoundException', 'ResourceNotFoundException']:
+                return None
+            raise
+    
+    # Nothing can be provisioned on an alias that was never created
+    if provisioned_concurrency is None and find_alias(function_name, qualifier) is None:
+        return
+    
+    try:
+        config = current_config()
+        if provisioned_concurrency is None:
+            if config:
+                print(f"Removing provisioned concurrency from {function_name}:{qualifier}")
+                lambda_client.delete_provisioned_concurrency_config(FunctionName=function_name, Qualifier=qualifier)
+            return
+        
+        if not config or config['RequestedProvisionedConcurrentExecutions'] != provisioned_concurrency:
+            print(f"Provisioning {provisioned_concurrency} concurrent executions for {function_name}:{qualifier}")
+            lambda_client.put_provisioned_concurrency_config(
+                FunctionName=function_name,
+                Qualifier=qualifier,
+                ProvisionedConcurrentExecutions=provisioned_concurrency
+            )
+    except ClientError as e:
+        print(f"Error setting provisioned concurrency for Lambda Function {function_name}: {e}")
+        raise
+    
+    # Environments are re-provisioned whenever the alias moves to a new version as well
+    def check():
+        config = current_config() or {}
+        if config.get('Status') == 'FAILED':
+            raise RuntimeError(f"Provisioned concurrency failed: {config.get('StatusReason', 'Unknown error')}")
+        return config if config.get('Status') == 'READY' else None
+    
+    awsWaiters.poll(check, f"function {function_name}:{qualifier} provisioned concurrency ready", timeout=timeout, initial_delay=5, max_delay=30)
+
+def function_target(function_name: str, qualifier: Optional[str] = None) -> str:
+    # Name an event source mapping invokes, qualified when it should go through an alias
+    return f"{function_name}:{qualifier}" if qualifier else function_name
+
+def delete_lambda_function(function_name: str) -> None:
+    lambda_client = awsClients.get_client('lambda')
+    
+    # Remove all event source mappings, including ones that invoke the function through its live alias
+    print(f"Deleting {function_name} source mappings")
+    prune_event_sources(function_name, [])
     
     # Delete function
     try:
         print(f"Deleting existing Lambda Function {function_name}")
         lambda_client.delete_function(FunctionName=function_name)
         
-        # Sleep for 5s as there is no waiter for deleting a function
-        time.sleep(5)
+        # There is no boto3 waiter for deleting a function
+        wait_for_function_deleted(lambda_client, function_name)
     except ClientError as e:
         if e.response['Error']['Code'] == 'ResourceNotFoundException':
             return
         raise
 
+def wait_for_function_deleted(lambda_client, function_name: str, timeout: float = 120) -> None:
+    def check():
+        try:
+            lambda_client.get_function(FunctionName=function_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                return True
+            raise
+        return None
+    
+    awsWaiters.poll(check, f"function {function_name} deleted", timeout=timeout, initial_delay=0.5, max_delay=5)
+
+def wait_for_mapping_state(lambda_client, uuid: str, ready_states: List[str], timeout: float = 600) -> Optional[dict]:
+    # Returns the mapping once it reaches a ready state, or None if it disappears
+    def check():
+        try:
+            mapping = lambda_client.get_event_source_mapping(UUID=uuid)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                return {}
+            raise
+        
+        state = mapping['State']
+        if state in ready_states:
+            return mapping
+        if state == 'CreateFailed':
+            raise RuntimeError(f"Creation failed: {mapping.get('StateTransitionReason', 'Unknown error')}")
+        print(f"Mapping {uuid} state: {state}, waiting...")
+        return None
+    
+    return awsWaiters.poll(check, f"mapping {uuid} {'/'.join(ready_states)}", timeout=timeout) or None
+
+def wait_for_mapping_deleted(lambda_client, uuid: str, timeout: float = 600) -> None:
+    # There is no boto3 waiter for deleting an event source mapping
+    def check():
+        try:
+            lambda_client.get_event_source_mapping(UUID=uuid)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                print(f"Mapping {uuid} successfully deleted")
+                return True
+            raise
+        return None
+    
+    awsWaiters.poll(check, f"mapping {uuid} deleted", timeout=timeout, initial_delay=2, max_delay=20)
+
 def find_lambda_function(function_name: str) -> Optional[dict]:
-    lambda_client = boto3.client('lambda')
+    lambda_client = awsClients.get_client('lambda')
     try:
         lambda_function = lambda_client.get_function(FunctionName=function_name)
         print(f"Found {function_name}")
@@ -81,46 +294,67 @@ def find_lambda_function(function_name: str) -> Optional[dict]:
             print(f"Error finding Lambda Function: {function_name}")
             raise
 
-def create_event_source(function_name: str, event_source_arn: str) -> dict:
-    lambda_client = boto3.client('lambda')
+def is_stream_source(event_source_arn: str) -> bool:
+    return any(s in event_source_arn for s in [':dynamodb:', ':kinesis:'])
+
+def event_source_options(event_source_arn: str, batch_size: int = 10, batching_window: Optional[int] = None,
+                         parallelization_factor: Optional[int] = None, filter_patterns: Optional[List[dict]] = None,
+                         maximum_concurrency: Optional[int] = None) -> dict:
+    # Settings shared by create and update, filter patterns are plain dicts serialised here
+    if parallelization_factor is not None and not is_stream_source(event_source_arn):
+        raise ValueError("ParallelizationFactor is only supported for DynamoDB and Kinesis streams")
+    if maximum_concurrency is not None and ':sqs:' not in event_source_arn:
+        raise ValueError("MaximumConcurrency is only supported for SQS queues")
+    
+    options = {'BatchSize': batch_size}
+    if batching_window is not None:
+        options['MaximumBatchingWindowInSeconds'] = batching_window
+    elif ':sqs:' in event_source_arn:
+        # Sent explicitly so an update also clears a window left by an earlier profile
+        options['MaximumBatchingWindowInSeconds'] = 0
+    if parallelization_factor is not None:
+        options['ParallelizationFactor'] = parallelization_factor
+    if filter_patterns:
+        options['FilterCriteria'] = {'Filters': [{'Pattern': json.dumps(p, sort_keys=True)} for p in filter_patterns]}
+    if maximum_concurrency is not None:
+        options['ScalingConfig'] = {'MaximumConcurrency': maximum_concurrency}
+    
+    # Let the handler return batchItemFailures so only failed messages are retried
+    if ':sqs:' in event_source_arn:
+        options['FunctionResponseTypes'] = ['ReportBatchItemFailures']
+    return options
+
+def create_event_source(function_name: str, event_source_arn: str, batch_size: int = 10, batching_window: Optional[int] = None,
+                        parallelization_factor: Optional[int] = None, filter_patterns: Optional[List[dict]] = None,
+                        maximum_concurrency: Optional[int] = None) -> dict:
+    lambda_client = awsClients.get_client('lambda')
     
     # Validate ARN format first
     if not event_source_arn.startswith('arn:aws:'):
         raise ValueError(f"Invalid event source ARN: {event_source_arn}")
+    options = event_source_options(event_source_arn, batch_size, batching_window, parallelization_factor, filter_patterns, maximum_concurrency)
         
     delete_event_source(lambda_client, function_name, event_source_arn)
 
-    # Create new mapping with manual state checks
+    # Create new mapping
     params = {
         'EventSourceArn': event_source_arn,
         'FunctionName': function_name,
         'Enabled': True,
-        'BatchSize': 10
+        **options
     }
     
-    if any(s in event_source_arn for s in [':dynamodb:', ':kinesis:']):
+    if is_stream_source(event_source_arn):
         params['StartingPosition'] = 'LATEST'
 
     try:
         response = lambda_client.create_event_source_mapping(**params)
         uuid = response['UUID']
         
-        # Wait for active state with manual polling
-        max_retries = 10
-        for _ in range(max_retries):
-            status = lambda_client.get_event_source_mapping(UUID=uuid)
-            state = status['State']
-            
-            if state in ['Enabled', 'Active']:
-                print(f"Mapping {uuid} is active")
-                break
-            if state == 'CreateFailed':
-                raise RuntimeError(f"Creation failed: {status.get('StateTransitionReason', 'Unknown error')}")
-            
-            print(f"Current state: {state}, waiting...")
-            time.sleep(30)
-        else:
-            raise TimeoutError("Timed out waiting for mapping activation")
+        # Wait for active state
+        if not wait_for_mapping_state(lambda_client, uuid, ['Enabled', 'Active']):
+            raise RuntimeError(f"Mapping {uuid} was deleted while waiting for activation")
+        print(f"Mapping {uuid} is active")
             
         return response
         
@@ -129,7 +363,7 @@ def create_event_source(function_name: str, event_source_arn: str) -> dict:
         raise
     
 def delete_event_source(lambda_client ,function_name: str, event_source_arn: str) -> bool:
-    # Remove existing mappings with manual state polling
+    # Remove existing mappings for this function and source
     existing_mappings = []
     paginator = lambda_client.get_paginator('list_event_source_mappings')
     
@@ -140,46 +374,172 @@ def delete_event_source(lambda_client ,function_name: str, event_source_arn: str
         print(f"Error listing event sources: {e}")
         raise
 
-    for mapping in existing_mappings:
-        uuid = mapping['UUID']
-        current_state = mapping['State']
-        
-        # Handle transitional states manually
-        while current_state in ['Creating', 'Updating', 'Deleting']:
-            print(f"Waiting for {uuid} to exit transitional state ({current_state})...")
-            time.sleep(2)
-            try:
-                mapping = lambda_client.get_event_source_mapping(UUID=uuid)
-                current_state = mapping['State']
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                    break
-                raise
-
-        if current_state in ['Enabled', 'Disabled', 'CreateFailed']:
+    # Mappings in a transitional state have to settle before they can be deleted
+    settled = awsWaiters.wait_all({
+        mapping['UUID']: (lambda uuid=mapping['UUID']: wait_for_mapping_state(lambda_client, uuid, ['Enabled', 'Disabled', 'CreateFailed']))
+        for mapping in existing_mappings
+    })
+    
+    def delete_mapping(uuid: str) -> None:
+        def attempt():
             try:
-                print(f"Deleting mapping {uuid} (state: {current_state})")
+                print(f"Deleting mapping {uuid}")
                 lambda_client.delete_event_source_mapping(UUID=uuid)
-                
-                # Poll until deleted
-                while True:
-                    time.sleep(60)
-                    try:
-                        lambda_client.get_event_source_mapping(UUID=uuid)
-                    except ClientError as e:
-                        if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                            print(f"Mapping {uuid} successfully deleted")
-                            break
-                        raise
+                return True
             except ClientError as e:
                 if e.response['Error']['Code'] == 'ResourceInUseException':
                     print(f"Mapping {uuid} still in use, retrying...")
-                    time.sleep(5)
-                    continue
+                    return None
+                if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                    return True
+                raise
+        
+        awsWaiters.poll(attempt, f"mapping {uuid} delete accepted", timeout=120)
+        wait_for_mapping_deleted(lambda_client, uuid)
+    
+    # Every mapping is deleted and waited on concurrently
+    awsWaiters.wait_all({uuid: (lambda uuid=uuid: delete_mapping(uuid)) for uuid, mapping in settled.items() if mapping})
+    return bool(settled)
+
+def find_event_source(function_name: str, event_source_arn: str) -> Optional[dict]:
+    lambda_client = awsClients.get_client('lambda')
+    paginator = lambda_client.get_paginator('list_event_source_mappings')
+    
+    for page in paginator.paginate(FunctionName=function_name, EventSourceArn=event_source_arn):
+        for mapping in page['EventSourceMappings']:
+            if mapping['State'] in ['Enabled', 'Enabling', 'Creating', 'Updating']:
+                print(f"Found mapping {mapping['UUID']} ({mapping['State']})")
+                return mapping
+    return None
+
+def _mapping_differs(mapping: dict, options: dict) -> bool:
+    # Filter patterns are compared parsed, the service may not keep our key order
+    def patterns(criteria: Optional[dict]) -> list:
+        return sorted(json.dumps(json.loads(f['Pattern']), sort_keys=True) for f in (criteria or {}).get('Filters', []))
+    
+    for key, value in options.items():
+        if key == 'FilterCriteria':
+            continue
+        if mapping.get(key) != value:
+            return True
+    if mapping.get('ScalingConfig') and 'ScalingConfig' not in options:
+        return True
+    return patterns(mapping.get('FilterCriteria')) != patterns(options.get('FilterCriteria'))
+
+def sync_event_source(function_name: str, event_source_arn: str, batch_size: int = 10, batching_window: Optional[int] = None,
+                      parallelization_factor: Optional[int] = None, filter_patterns: Optional[List[dict]] = None,
+                      maximum_concurrency: Optional[int] = None) -> Optional[dict]:
+    # Creates the mapping if missing, updates it in place if its settings drifted, otherwise leaves it alone
+    lambda_client = awsClients.get_client('lambda')
+    options = event_source_options(event_source_arn, batch_size, batching_window, parallelization_factor, filter_patterns, maximum_concurrency)
+    
+    mapping = find_event_source(function_name, event_source_arn)
+    if mapping is None:
+        return create_event_source(function_name, event_source_arn, batch_size, batching_window, parallelization_factor, filter_patterns, maximum_concurrency)
+    if not _mapping_differs(mapping, options):
+        return None
+    
+    try:
+        uuid = mapping['UUID']
+        print(f"Updating mapping {uuid} settings")
+        update = dict(options)
+        update.setdefault('FilterCriteria', {})
+        if ':sqs:' in event_source_arn:
+            update.setdefault('ScalingConfig', {})
+        response = lambda_client.update_event_source_mapping(UUID=uuid, **update)
+        wait_for_mapping_state(lambda_client, uuid, ['Enabled', 'Active'])
+        return response
+    except ClientError as e:
+        print(f"Error updating event source mapping: {e}")
+        raise
+
+def prune_event_sources(function_name: str, keep_arns: List[str], qualifier: Optional[str] = None) -> None:
+    # Remove mappings left pointing at sources that are no longer wanted, e.g. an old table stream,
+    # or invoking the function through a different qualifier than the one wanted now
+    lambda_client = awsClients.get_client('lambda')
+    paginator = lambda_client.get_paginator('list_event_source_mappings')
+    wanted = function_target(function_name, qualifier)
+    
+    stale = set()
+    for target in {function_name, function_target(function_name, LIVE_ALIAS), wanted}:
+        try:
+            for page in paginator.paginate(FunctionName=target):
+                for mapping in page['EventSourceMappings']:
+                    mapped = mapping['FunctionArn'].split(':function:')[-1]
+                    if mapping['EventSourceArn'] not in keep_arns or mapped != wanted:
+                        stale.add((mapped, mapping['EventSourceArn']))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
                 raise
+    
+    for mapped, arn in stale:
+        print(f"Removing stale mapping from {arn} to {mapped}")
+        delete_event_source(lambda_client, mapped, arn)
+
+def set_reserved_concurrency(function_name: str, reserved_concurrency: Optional[int]) -> None:
+    # None removes the reservation so the function uses the unreserved pool again
+    lambda_client = awsClients.get_client('lambda')
+    
+    try:
+        current = lambda_client.get_function_concurrency(FunctionName=function_name).get('ReservedConcurrentExecutions')
+        if current == reserved_concurrency:
+            return
+        
+        if reserved_concurrency is None:
+            print(f"Removing reserved concurrency from {function_name}")
+            lambda_client.delete_function_concurrency(FunctionName=function_name)
+        else:
+            print(f"Reserving {reserved_concurrency} concurrent executions for {function_name}")
+            lambda_client.put_function_concurrency(FunctionName=function_name, ReservedConcurrentExecutions=reserved_concurrency)
+    except ClientError as e:
+        print(f"Error setting concurrency for Lambda Function {function_name}: {e}")
+        raise
+
+def create_schedule(function_name: str, schedule_expression: str) -> dict:
+    # Invoke the function on a timer, e.g. to flush buffered work when no events arrive
+    events_client = awsClients.get_client('events')
+    lambda_client = awsClients.get_client('lambda')
+    rule_name = f"{function_name}-schedule"[:64]
+    
+    try:
+        rule = events_client.put_rule(Name=rule_name, ScheduleExpression=schedule_expression, State='ENABLED')
+        function_arn = lambda_client.get_function(FunctionName=function_name)['Configuration']['FunctionArn']
+        
+        try:
+            lambda_client.add_permission(
+                FunctionName=function_name,
+                StatementId=f"{rule_name}-invoke"[:100],
+                Action='lambda:InvokeFunction',
+                Principal='events.amazonaws.com',
+                SourceArn=rule['RuleArn']
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceConflictException':
+                raise
+        
+        events_client.put_targets(Rule=rule_name, Targets=[{'Id': 'lambda', 'Arn': function_arn}])
+        print(f"Scheduled {function_name} with {schedule_expression}")
+        return rule
+    
+    except ClientError as e:
+        print(f"Error scheduling Lambda Function {function_name}: {e}")
+        raise
+
+def delete_schedule(function_name: str) -> None:
+    events_client = awsClients.get_client('events')
+    rule_name = f"{function_name}-schedule"[:64]
+    
+    try:
+        events_client.remove_targets(Rule=rule_name, Ids=['lambda'])
+        events_client.delete_rule(Name=rule_name)
+        print(f"Deleted schedule {rule_name}")
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceNotFoundException':
+            print(f"Error deleting schedule {rule_name}: {e}")
+            raise
 
 def list_lambda_functions() -> List[str]:
-    lambda_client = boto3.client('lambda')
+    lambda_client = awsClients.get_client('lambda')
     funcs = []
     paginator = lambda_client.get_paginator('list_functions')
     
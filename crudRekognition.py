@@ -0,0 +1,150 @@
+import os, sys
+import awsClients
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, List
+from botocore.exceptions import ClientError
+
+# Reference ids come from the module the Rekognition handler is packaged with, so both always agree
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Templates")
+if TEMPLATES_DIR not in sys.path:
+    sys.path.append(TEMPLATES_DIR)
+from ReferenceIds import reference_id
+
+def create_collection(collection_id: str) -> dict:
+    rekognition = awsClients.get_client('rekognition')
+
+    try:
+        print(f"Creating Rekognition Collection {collection_id}")
+        response = rekognition.create_collection(CollectionId=collection_id)
+        print(f"Collection '{collection_id}' created successfully")
+        return response
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceAlreadyExistsException':
+            raise ValueError(f"Collection {collection_id} already exists") from e
+        else:
+            print(f"Error creating collection: {e.response['Error']['Message']}")
+            raise
+
+def find_collection(collection_id: str) -> Optional[dict]:
+    rekognition = awsClients.get_client('rekognition')
+    try:
+        response = rekognition.describe_collection(CollectionId=collection_id)
+        print(f"Found {collection_id}")
+        return response
+    except ClientError as e:
+        print(f"Error searching for {collection_id}")
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
+
+def delete_collection(collection_id: str) -> None:
+    rekognition = awsClients.get_client('rekognition')
+
+    try:
+        print(f"Deleting existing Rekognition Collection {collection_id}")
+        rekognition.delete_collection(CollectionId=collection_id)
+        print(f"Collection '{collection_id}' deleted successfully")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            print(f"Collection '{collection_id}' does not exist")
+        else:
+            print(f"Error deleting collection: {e.response['Error']['Message']}")
+            raise
+
+def list_external_image_ids(collection_id: str) -> set:
+    rekognition = awsClients.get_client('rekognition')
+    external_ids = set()
+    paginator = rekognition.get_paginator('list_faces')
+    
+    for page in paginator.paginate(CollectionId=collection_id):
+        external_ids.update(face['ExternalImageId'] for face in page.get('Faces', []) if 'ExternalImageId' in face)
+    return external_ids
+
+def index_faces(collection_id: str, images: Dict[str, bytes]) -> Dict[str, Any]:
+    # `images` is keyed by external id, see reference_id
+    rekognition = awsClients.get_client('rekognition')
+    indexed = {}
+
+    # Reference images are indexed once so uploads only need a search
+    for key, image_bytes in images.items():
+        try:
+            response = rekognition.index_faces(
+                CollectionId=collection_id,
+                Image={'Bytes': image_bytes},
+                ExternalImageId=key,
+                QualityFilter='AUTO'
+            )
+            indexed[key] = [record['Face']['FaceId'] for record in response.get('FaceRecords', [])]
+            print(f"Indexed {len(indexed[key])} faces from {key} into {collection_id}")
+        except ClientError as e:
+            print(f"Error indexing faces from {key}: {e.response['Error']['Message']}")
+            raise
+
+    return indexed
+
+def list_faces_by_external_id(collection_id: str) -> Dict[str, List[str]]:
+    rekognition = awsClients.get_client('rekognition')
+    faces = defaultdict(list)
+    paginator = rekognition.get_paginator('list_faces')
+
+    for page in paginator.paginate(CollectionId=collection_id):
+        for face in page.get('Faces', []):
+            faces[face.get('ExternalImageId', '')].append(face['FaceId'])
+    return dict(faces)
+
+def delete_faces(collection_id: str, face_ids: List[str]) -> None:
+    rekognition = awsClients.get_client('rekognition')
+    for i in range(0, len(face_ids), 4096):
+        rekognition.delete_faces(CollectionId=collection_id, FaceIds=face_ids[i:i + 4096])
+
+def index_s3_image(collection_id: str, bucket_name: str, key: str, external_id: str) -> List[str]:
+    rekognition = awsClients.get_client('rekognition')
+    try:
+        response = rekognition.index_faces(
+            CollectionId=collection_id,
+            Image={'S3Object': {'Bucket': bucket_name, 'Name': key}},
+            ExternalImageId=external_id,
+            QualityFilter='AUTO'
+        )
+    except ClientError as e:
+        print(f"Error indexing faces from {key}: {e.response['Error']['Message']}")
+        raise
+
+    face_ids = [record['Face']['FaceId'] for record in response.get('FaceRecords', [])]
+    print(f"Indexed {len(face_ids)} faces from {key} into {collection_id}")
+    return face_ids
+
+def sync_collection(collection_id: str, bucket_name: str, prefix: str, max_workers: int = 4) -> Dict[str, Any]:
+    # Brings the collection in line with the reference photos under the prefix, only touching what changed
+    s3_client = awsClients.get_client('s3')
+    desired = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/'):
+                desired[reference_id(obj['Key'], obj['ETag'])] = obj['Key']
+
+    existing = list_faces_by_external_id(collection_id)
+    stale = [external_id for external_id in existing if external_id not in desired]
+    missing = {external_id: key for external_id, key in desired.items() if external_id not in existing}
+
+    stale_faces = [face_id for external_id in stale for face_id in existing[external_id]]
+    if stale_faces:
+        print(f"Removing {len(stale_faces)} faces from {len(stale)} outdated references in {collection_id}")
+        delete_faces(collection_id, stale_faces)
+
+    # IndexFaces has a low request rate limit, so only a few run at once
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(index_s3_image, collection_id, bucket_name, key, external_id) for external_id, key in missing.items()]
+            for future in as_completed(futures):
+                future.result()
+
+    print(f"Collection '{collection_id}': {len(missing)} references indexed, {len(stale)} removed, {len(desired) - len(missing)} unchanged")
+    return {
+        'Indexed': len(missing),
+        'Removed': len(stale),
+        'Unchanged': len(desired) - len(missing),
+        'ReferenceIds': sorted(desired)
+    }
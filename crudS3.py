@@ -1,18 +1,88 @@
-import boto3, os, zipfile, time
-from typing import Optional, Dict, Any
+import os, zipfile, time, threading, hashlib
+import awsClients, awsWaiters
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, List
 from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from boto3.exceptions import S3UploadFailedError
 
-def empty_bucket(bucket_name: str) -> None:
-    s3 = boto3.client('s3')
+class TokenBucket:
+    # Thread-safe token bucket, refills at `rate` tokens per second up to `capacity`
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+def _delete_batch(s3_client, bucket_name: str, batch: List[dict], max_retries: int) -> Dict[str, int]:
+    # Delete one batch of up to 1000 keys, retrying only the keys reported in Errors
+    pending = batch
+    for attempt in range(max_retries + 1):
+        response = s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': pending, 'Quiet': True})
+        errors = response.get('Errors', [])
+        if not errors:
+            return {'Deleted': len(batch), 'Failed': 0}
+
+        failed = {(e['Key'], e.get('VersionId')) for e in errors}
+        pending = [o for o in pending if (o['Key'], o.get('VersionId')) in failed]
+        if attempt < max_retries:
+            time.sleep(awsWaiters.backoff_delay(attempt, 1, 10))
+
+    print(f"Failed to delete {len(pending)} objects from {bucket_name}: {errors[0].get('Message', errors[0].get('Code'))}")
+    return {'Deleted': len(batch) - len(pending), 'Failed': len(pending)}
+
+def _list_delete_batches(s3_client, bucket_name: str, batch_size: int):
+    # Page through every object version and delete marker, yielding delete batches
+    batch = []
+    paginator = s3_client.get_paginator('list_object_versions')
+    for page in paginator.paginate(Bucket=bucket_name):
+        for obj in page.get('Versions', []) + page.get('DeleteMarkers', []):
+            batch.append({'Key': obj['Key'], 'VersionId': obj['VersionId']})
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def empty_bucket(bucket_name: str, max_workers: int = 8, max_retries: int = 3) -> Dict[str, int]:
+    s3 = awsClients.get_client('s3')
+    progress = {'Listed': 0, 'Deleted': 0, 'Failed': 0, 'Batches': 0}
     
     try:
-        # Delete all objects
+        # Delete all objects, versions and delete markers in 1000-key batches
         print(f"Emptying bucket: {bucket_name}")
-        objects = s3.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' in objects:
-            delete_keys = [{'Key': obj['Key']} for obj in objects['Contents']]
-            s3.delete_objects(Bucket=bucket_name, Delete={'Objects': delete_keys})
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = set()
+            for batch in _list_delete_batches(s3, bucket_name, 1000):
+                progress['Listed'] += len(batch)
+                futures.add(executor.submit(_delete_batch, s3, bucket_name, batch, max_retries))
+
+                # Bound the number of in-flight batches so listing cannot run far ahead
+                if len(futures) >= max_workers * 2:
+                    done = next(as_completed(futures))
+                    futures.remove(done)
+                    _record_drain(progress, done.result(), bucket_name)
 
+            for future in as_completed(futures):
+                _record_drain(progress, future.result(), bucket_name)
+
+        if progress['Failed']:
+            raise RuntimeError(f"Failed to delete {progress['Failed']} objects from bucket {bucket_name}")
         print(f"Bucket {bucket_name} emptied successfully")
         
     except ClientError as e:
@@ -21,35 +91,147 @@ def empty_bucket(bucket_name: str) -> None:
         else:
             print(f"Error emptying Bucket {bucket_name}")
             raise
-        
-def upload_to_s3(bucket_name: str) -> None:
+
+    return progress
+
+def _record_drain(progress: Dict[str, int], result: Dict[str, int], bucket_name: str) -> None:
+    progress['Deleted'] += result['Deleted']
+    progress['Failed'] += result['Failed']
+    progress['Batches'] += 1
+    print(f"Emptying {bucket_name}: {progress['Deleted']}/{progress['Listed']} deleted, {progress['Failed']} failed")
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def ensure_bucket(bucket_name: str) -> bool:
+    # Creates a private bucket in the current region unless it exists, returns True if it was created
+    s3_client = awsClients.get_client('s3')
+    try:
+        s3_client.head_bucket(Bucket=bucket_name)
+        return False
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ['404', 'NoSuchBucket']:
+            raise
+
+    params = {'Bucket': bucket_name}
+    region = awsClients.get_region()
+    if region != 'us-east-1':
+        params['CreateBucketConfiguration'] = {'LocationConstraint': region}
+    s3_client.create_bucket(**params)
+    awsWaiters.boto_wait(s3_client, 'bucket_exists', f"bucket {bucket_name} exists", Bucket=bucket_name)
+    print(f"Created bucket {bucket_name}")
+    return True
+
+def delete_bucket(bucket_name: str) -> bool:
+    # Empties and deletes the bucket, returns False if there was no bucket
+    s3_client = awsClients.get_client('s3')
+    try:
+        s3_client.head_bucket(Bucket=bucket_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchBucket']:
+            return False
+        raise
+
+    empty_bucket(bucket_name)
+    s3_client.delete_bucket(Bucket=bucket_name)
+    awsWaiters.boto_wait(s3_client, 'bucket_not_exists', f"bucket {bucket_name} deleted", Bucket=bucket_name)
+    print(f"Deleted bucket {bucket_name}")
+    return True
+
+def upload_to_s3(bucket_name: str, zip_path: Optional[str] = None, max_workers: int = 8,
+                 rate_per_second: Optional[float] = None,
+                 multipart_threshold: int = 8 * 1024 * 1024,
+                 upload_first: Optional[List[str]] = None,
+                 skip_unchanged: bool = False) -> Dict[str, Any]:
     # Check if images.zip exists
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    zip_path = os.path.join(script_dir, 'images.zip')
+    if zip_path is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        zip_path = os.path.join(script_dir, 'images.zip')
     if not os.path.exists(zip_path):
         raise FileNotFoundError(f"images.zip not found at {zip_path}")
-    
-    # Extract images
-    extract_dir = os.path.join(script_dir, 'extracted_images')
-    os.makedirs(extract_dir, exist_ok=True)
+    if max_workers < 1:
+        raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+
+    s3_client = awsClients.get_client('s3')
+    limiter = TokenBucket(rate_per_second) if rate_per_second else None
+
+    # Objects above the threshold are sent as multipart uploads
+    transfer_config = TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_threshold,
+        max_concurrency=4
+    )
+
+    # Single part uploads have an MD5 ETag, so unchanged objects can be recognised
+    existing_etags = {}
+    if skip_unchanged:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name):
+            existing_etags.update({obj['Key']: obj['ETag'].strip('"') for obj in page.get('Contents', [])})
+
+    latencies = {}
+    failures = []
+    skipped = []
+    total_bytes = 0
+
+    # Members are streamed straight out of the archive, nothing is extracted to disk
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_dir)
-    
-    # Upload files
-    s3_client = boto3.client('s3')
-    start_time = None
-    
-    for root, _, files in os.walk(extract_dir):
-        for file_name in files:
-            if start_time is not None:
-                elapsed = time.time() - start_time
-                if elapsed < 30:
-                    time.sleep(30 - elapsed)
-            
-            start_time = time.time()
-            file_path = os.path.join(root, file_name)
-            relative_path = os.path.relpath(file_path, extract_dir)
-            s3_key = relative_path.replace(os.path.sep, '/')
-            
-            s3_client.upload_file(Filename=file_path, Bucket=bucket_name, Key=s3_key)
-            print(f"Uploaded {s3_key} to bucket {bucket_name}")
+        members = [m for m in zip_ref.infolist() if not m.is_dir()]
+        if existing_etags:
+            unchanged = [m for m in members if m.file_size < multipart_threshold and m.filename in existing_etags
+                         and hashlib.md5(zip_ref.read(m)).hexdigest() == existing_etags[m.filename]]
+            skipped = [m.filename for m in unchanged]
+            members = [m for m in members if m not in unchanged]
+
+        def upload_member(member: zipfile.ZipInfo) -> float:
+            if limiter:
+                limiter.acquire()
+            start = time.perf_counter()
+            with zip_ref.open(member) as body:
+                s3_client.upload_fileobj(Fileobj=body, Bucket=bucket_name, Key=member.filename, Config=transfer_config)
+            return time.perf_counter() - start
+
+        def record_result(member: zipfile.ZipInfo, result) -> None:
+            nonlocal total_bytes
+            try:
+                latencies[member.filename] = result()
+                total_bytes += member.file_size
+                print(f"Uploaded {member.filename} to bucket {bucket_name}")
+            except (ClientError, S3UploadFailedError, OSError, zipfile.BadZipFile) as e:
+                print(f"Error uploading {member.filename}: {e}")
+                failures.append({'Key': member.filename, 'Error': str(e)})
+
+        # Keys other objects depend on (e.g. the reference image) go up before the pool starts
+        first = [m for m in members if m.filename in (upload_first or [])]
+        rest = [m for m in members if m not in first]
+
+        start_time = time.perf_counter()
+        for member in first:
+            record_result(member, lambda: upload_member(member))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(upload_member, m): m for m in rest}
+            for future in as_completed(futures):
+                record_result(futures[future], future.result)
+        elapsed = time.perf_counter() - start_time
+
+    object_latencies = list(latencies.values())
+    summary = {
+        'Uploaded': len(latencies),
+        'Failed': len(failures),
+        'Skipped': len(skipped),
+        'Bytes': total_bytes,
+        'ElapsedSeconds': elapsed,
+        'BytesPerSecond': total_bytes / elapsed if elapsed > 0 else 0.0,
+        'LatencySeconds': latencies,
+        'LatencyP50': _percentile(object_latencies, 50),
+        'LatencyP95': _percentile(object_latencies, 95),
+        'LatencyMax': max(object_latencies, default=0.0),
+        'Failures': failures
+    }
+    print(f"Uploaded {summary['Uploaded']} objects ({total_bytes} bytes) in {elapsed:.2f}s, {summary['Failed']} failed, {summary['Skipped']} unchanged")
+    return summary
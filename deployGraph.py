@@ -0,0 +1,96 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Any, List, Optional
+
+class DeployGraph:
+    # Runs deploy steps as a DAG, independent steps run concurrently once their dependencies finish
+    def __init__(self):
+        self.steps = {}
+        self.deps = {}
+        self.timings = {}
+
+    def add(self, name: str, step: Callable[[Dict[str, Any]], Any], deps: Optional[List[str]] = None) -> None:
+        if name in self.steps:
+            raise ValueError(f"Step {name} already defined")
+        self.steps[name] = step
+        self.deps[name] = list(deps or [])
+
+    def _validate(self) -> None:
+        for name, deps in self.deps.items():
+            for dep in deps:
+                if dep not in self.steps:
+                    raise ValueError(f"Step {name} depends on unknown step {dep}")
+
+        # Kahn's algorithm, anything left over is part of a cycle
+        remaining = {name: set(deps) for name, deps in self.deps.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Dependency cycle between steps: {sorted(remaining)}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def run(self, max_workers: int = 8) -> Dict[str, Any]:
+        self._validate()
+        results = {}
+        pending = dict(self.deps)
+        running = {}
+        error = None
+        start_time = time.perf_counter()
+
+        def run_step(name: str) -> Any:
+            started = time.perf_counter()
+            try:
+                return self.steps[name](results)
+            finally:
+                self.timings[name] = (started - start_time, time.perf_counter() - start_time)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                # Start every step whose dependencies are complete, unless something already failed
+                if error is None:
+                    for name in [n for n, deps in pending.items() if all(d in results for d in deps)]:
+                        del pending[name]
+                        running[executor.submit(run_step, name)] = name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        print(f"Deploy step {name} failed: {e}")
+                        error = error or e
+
+        if error is not None:
+            raise error
+        return results
+
+    def critical_path(self) -> List[str]:
+        # Walk back from the last step to finish through whichever dependency finished last
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while self.deps[name]:
+            name = max(self.deps[name], key=lambda n: self.timings[n][1])
+            path.append(name)
+        return list(reversed(path))
+
+    def print_timings(self) -> None:
+        if not self.timings:
+            return
+        total = max(end for _, end in self.timings.values())
+        serial = sum(end - start for start, end in self.timings.values())
+        critical = self.critical_path()
+
+        print(f"\nDeploy finished in {total:.1f}s (steps add up to {serial:.1f}s run one after another)")
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            marker = '*' if name in critical else ' '
+            print(f" {marker} {name:<20} {start:7.1f}s -> {end:7.1f}s  ({end - start:.1f}s)")
+        print(f"Critical path: {' -> '.join(critical)}")
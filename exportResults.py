@@ -0,0 +1,28 @@
+import argparse
+import crudDynamo
+
+# Bulk export of the results table for auditing, e.g.
+#   python exportResults.py facedata-<account>-<region>-<user> results.parquet --format parquet
+#   python exportResults.py facedata-<account>-<region>-<user> alerts.csv --format csv --alerts --since 2025-01-01
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export the face results table as JSON lines, CSV or Parquet")
+    parser.add_argument('table', help="Results table name")
+    parser.add_argument('output', help="File to write")
+    parser.add_argument('--format', choices=['jsonl', 'csv', 'parquet'], default='jsonl')
+    parser.add_argument('--alerts', action='store_true', help="Only rows in the ALERT state, read from the alert index")
+    parser.add_argument('--since', help="With --alerts, earliest ISO timestamp to include")
+    parser.add_argument('--until', help="With --alerts, latest ISO timestamp to include")
+    parser.add_argument('--segments', type=int, default=16, help="Parallel scan segments for a full export")
+    parser.add_argument('--fields', help="Comma separated columns, defaults to those in the first rows")
+    args = parser.parse_args(argv)
+
+    if args.alerts:
+        items = crudDynamo.query_by_alert_state(args.table, since=args.since, until=args.until)
+    else:
+        items = crudDynamo.scan_items(args.table, total_segments=args.segments)
+    fields = args.fields.split(',') if args.fields else None
+    return crudDynamo.export_items(items, args.output, file_format=args.format, fields=fields)
+
+if __name__ == "__main__":
+    main()
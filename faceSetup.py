@@ -1,119 +1,488 @@
-import boto3, yaml, os, time
-import crudCFTemplate, crudDynamo, crudLambdaFunction, crudS3
+import yaml, os, sys, time, zipfile, hashlib
+from typing import Optional, Dict, Any, Tuple
+import awsClients, awsWaiters, crudCFTemplate, crudDynamo, crudLambdaFunction, crudRekognition, crudS3, deployGraph, throughputProfiles
 
-def main():
+# The alert rules are parsed here with the same module the handlers use
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Templates")
+if TEMPLATES_DIR not in sys.path:
+    sys.path.append(TEMPLATES_DIR)
+import AlertRules
+
+# Event source mappings accept at most this many filters
+MAX_FILTER_PATTERNS = 5
+
+# Settings for one pipeline, fleetSetup.py overrides them per tenant from a manifest
+DEFAULT_SETTINGS = {
     # Global naming configuration
-    APPLICATION = "face"
-    USER_ID = "s2131971"
-    USER_EMAIL = "john.doe@example.com"
+    'application': "face",
+    'user_id': "s2131971",
+    'user_email': "john.doe@example.com",
+    'source_image': "images/groupphoto.png",
+    'use_face_collection': True,
+    'reference_prefix': None,  # e.g. "references/" to match uploads against every photo under that prefix
+    'incremental': True,  # Update resources in place instead of destroying and recreating them
+    'alert_window_seconds': 300,  # Alerts are sent as one digest per window, 0 sends them immediately
+    'alert_brightness_below': 10,
+    'alert_similarity_below': 55,
+    'alert_rules': None,  # e.g. "dark: backgroundBrightness < 10 and highestSimilarity < 55", replaces the two thresholds above
+    'alert_rules_parameter': None,  # SSM parameter holding the rules, read at cold start so they change without a deploy
+    'result_ttl_days': 90,  # Result rows expire this long after they last changed, 0 keeps them forever
+    'throughput_profile': os.environ.get('FACE_THROUGHPUT_PROFILE', 'default'),  # See throughputProfiles.PROFILES
+    'image_max_dimension': 1600,  # Images are downsized to this before Rekognition, 0 sends the originals
+    'pillow_layer_arn': os.environ.get('FACE_PILLOW_LAYER_ARN'),  # Lambda layer providing Pillow for the resize
+    'log_level': "INFO",  # DEBUG also logs every Rekognition and stream payload
+    'rekognition_memory_mb': 512,  # CPU scales with memory, which shortens init and the image resize
+    'lambda_architecture': os.environ.get('FACE_LAMBDA_ARCHITECTURE', 'x86_64'),  # arm64 is cheaper, layers must be built for it
+    'snap_start': False  # Snapshot the initialised Rekognition function, cannot be combined with provisioned concurrency
+}
+
+def resolve_settings(overrides: Optional[dict] = None) -> dict:
+    unknown = set(overrides or {}) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    settings = dict(DEFAULT_SETTINGS, **(overrides or {}))
+    AlertRules.parse_rules(settings['alert_rules'] or '')
+    return settings
+
+def caller_context() -> Tuple[str, str]:
+    # Account and region go into every resource name, a fleet looks them up once for all tenants
+    print("Retriveing infromation for resource naming")
+    account_id = awsClients.get_client('sts').get_caller_identity()['Account']
+    return account_id, awsClients.get_region()
+
+def tenant_resource_name(settings: dict, context: Tuple[str, str], service: str) -> str:
+    account_id, region = context
+    return f"{settings['application']}{service}-{account_id}-{region}-{settings['user_id']}"
+
+def deploy(overrides: Optional[dict] = None, context: Optional[Tuple[str, str]] = None, report: bool = True) -> Dict[str, Any]:
+    settings = resolve_settings(overrides)
+    USER_EMAIL = settings['user_email']
+    SOURCE_IMAGE = settings['source_image']
+    USE_FACE_COLLECTION = settings['use_face_collection']
+    REFERENCE_PREFIX = settings['reference_prefix']
+    INCREMENTAL = settings['incremental']
+    ALERT_WINDOW_SECONDS = settings['alert_window_seconds']
+    ALERT_BRIGHTNESS_BELOW = settings['alert_brightness_below']
+    ALERT_SIMILARITY_BELOW = settings['alert_similarity_below']
+    ALERT_RULES = settings['alert_rules']
+    ALERT_RULES_PARAMETER = settings['alert_rules_parameter']
+    RESULT_TTL_DAYS = settings['result_ttl_days']
+    THROUGHPUT_PROFILE = settings['throughput_profile']
+    IMAGE_MAX_DIMENSION = settings['image_max_dimension']
+    PILLOW_LAYER_ARN = settings['pillow_layer_arn']
+    LOG_LEVEL = settings['log_level']
+    REKOGNITION_MEMORY_MB = settings['rekognition_memory_mb']
+    LAMBDA_ARCHITECTURE = settings['lambda_architecture']
+    SNAP_START = settings['snap_start']
 
     if USER_EMAIL == "john.doe@example.com":
         raise ValueError("Default email is being used; email alerts will not work. Please update the USER_EMAIL to a valid address.")
+    if REFERENCE_PREFIX and not USE_FACE_COLLECTION:
+        raise ValueError("A reference set is indexed into a face collection, USE_FACE_COLLECTION must be enabled.")
+    if LAMBDA_ARCHITECTURE not in ['x86_64', 'arm64']:
+        raise ValueError(f"Unsupported Lambda architecture '{LAMBDA_ARCHITECTURE}', expected x86_64 or arm64.")
     
     # Get AWS account and region context
-    print("Retriveing infromation for resource naming")
-    account_id = boto3.client('sts').get_caller_identity()['Account']
-    region = boto3.session.Session().region_name
+    context = context or caller_context()
+    account_id = context[0]
     
     # Resource name generator
     def resource_name(service: str) -> str:
-        return f"{APPLICATION}{service}-{account_id}-{region}-{USER_ID}"
+        return tenant_resource_name(settings, context, service)
 
-    # Initialise DynamoDB Table
-    print("\nInitilising DynamoDB Table")
     table_name = resource_name("data")
-    exisiting_table = crudDynamo.find_table(table_name)
-    
-    # Cleanup existing DynamoDB
-    if exisiting_table:
-        crudDynamo.delete_table(table_name)
-    
-    dynamo_response = crudDynamo.create_table(
-        table_name=table_name,
-        partition_key="id",
-    )
-    
-    # Initialise CloudFormation Stack
-    print("\nInitilising CloudFormation Stack")
+    cache_table_name = resource_name("cache")
+    alert_table_name = resource_name("alerts")
     stack_name = resource_name("queuebucket")
-    existing_stack = crudCFTemplate.find_stack(stack_name)
-    
-    # Cleanup existing CloudFormation Stack
-    if existing_stack:
-        try:
-            # Empty S3 bucket before deletion
-            bucket_name = crudCFTemplate.get_stack_output(existing_stack, "S3BucketName")
-            crudS3.empty_bucket(bucket_name)
-        except ValueError as e:
-            print(f"No bucket to empty: {str(e)}")
-            
-        crudCFTemplate.delete_stack(stack_name)
+    collection_id = resource_name("faces")
+    email_lambda_name = resource_name("lambdaemail")
+    face_lambda_name = resource_name("lambdarek")
 
-    # Define names of services created by the template
-    stack_params = [
-        {'ParameterKey': 'BucketName', 'ParameterValue': resource_name("bucket")},
-        {'ParameterKey': 'QueueName', 'ParameterValue': resource_name("queue")},
-        {'ParameterKey': 'TopicName', 'ParameterValue': resource_name("topic")},
-        {'ParameterKey': 'TopicEmail', 'ParameterValue': USER_EMAIL}
-    ]
-    
-    stack = crudCFTemplate.create_stack(
-        stack_name=stack_name,
-        template_path=os.path.join("Templates", "QueueBucket.yaml"),
-        parameters=stack_params
-    )
-
-    # Get stack ARN outputs
-    sqs_arn = crudCFTemplate.get_stack_output(stack, 'SQSArn')
-    sns_topic_arn = crudCFTemplate.get_stack_output(stack, 'SNSTopicArn')
-    stream_arn = dynamo_response['LatestStreamArn']
-    if not stream_arn:
-        raise ValueError("DynamoDB stream ARN not found")
-        
     # Lambda Configuration
     lambda_role = f"arn:aws:iam::{account_id}:role/LabRole"
-    
-    # Email Alert Lambda
-    print("\nInitilising Lambda email alert function")
-    email_lambda_name = resource_name("lambdaemail")
-    exisiting_email_function = crudLambdaFunction.find_lambda_function(email_lambda_name)
-    
-    if exisiting_email_function:
-        crudLambdaFunction.delete_lambda_function(email_lambda_name)
+    # Packages are built with the Templates modules each handler imports, and only go through this bucket when too large to send inline
+    artifact_bucket = resource_name("artifacts")
+    profile = throughputProfiles.get_profile(THROUGHPUT_PROFILE, crudLambdaFunction.FUNCTION_TIMEOUT)
+    print(f"Using throughput profile '{THROUGHPUT_PROFILE}'")
+    if SNAP_START and profile['provisioned_concurrency']:
+        raise ValueError(f"SNAP_START cannot be used with profile '{THROUGHPUT_PROFILE}', it sets provisioned concurrency.")
+
+    # Pre-initialised environments are reached through the live alias, and build their clients during init
+    rek_preinitialised = SNAP_START or bool(profile['provisioned_concurrency'])
+    rek_qualifier = crudLambdaFunction.LIVE_ALIAS if rek_preinitialised else None
+
+    # Rules from a parameter can change after this deploy, so they cannot narrow the stream filter either
+    if ALERT_RULES_PARAMETER:
+        parameter_rules = awsClients.get_client('ssm').get_parameter(Name=ALERT_RULES_PARAMETER, WithDecryption=True)['Parameter']['Value']
+        AlertRules.parse_rules(parameter_rules)
+        alert_env = {'ALERT_RULES_PARAMETER': ALERT_RULES_PARAMETER}
+        alert_filters = [{'eventName': AlertRules.STREAM_EVENTS}]
+    else:
+        alert_rules = ALERT_RULES or AlertRules.default_rules(ALERT_BRIGHTNESS_BELOW, ALERT_SIMILARITY_BELOW)
+        alert_env = {'ALERT_RULES': alert_rules}
+        alert_filters = AlertRules.RuleSet(AlertRules.parse_rules(alert_rules)).filter_patterns()
+        if len(alert_filters) > MAX_FILTER_PATTERNS:
+            print(f"{len(alert_filters)} alert rules are more than a mapping can filter on, the email function will check every change")
+            alert_filters = [{'eventName': AlertRules.STREAM_EVENTS}]
+
+    # Cached results are only valid for the reference image they were scored against
+    with zipfile.ZipFile("images.zip", 'r') as zip_ref:
+        reference_bytes = zip_ref.read(SOURCE_IMAGE)
+    reference_version = hashlib.sha256(reference_bytes).hexdigest()[:16]
+    rekognition_env = {
+        'SOURCE_IMAGE': SOURCE_IMAGE,
+        'DYNAMODB_TABLE': table_name,
+        'CACHE_TABLE': cache_table_name,
+        'REFERENCE_VERSION': reference_version,
+        'MAX_WORKERS': str(profile['handler_workers']),
+        'INLINE_IMAGES': 'true',
+        'LOG_LEVEL': LOG_LEVEL,
+        'RESULT_TTL_SECONDS': str(RESULT_TTL_DAYS * 24 * 3600),
+        **alert_env
+    }
+    if USE_FACE_COLLECTION:
+        rekognition_env['FACE_COLLECTION'] = collection_id
+    if rek_preinitialised:
+        rekognition_env['PREWARM_CLIENTS'] = 'true'
+    if REFERENCE_PREFIX:
+        rekognition_env['REFERENCE_PREFIX'] = REFERENCE_PREFIX
+
+    # Pre-processing needs Pillow, without the layer the handler keeps reading straight from S3
+    rekognition_layers = []
+    if IMAGE_MAX_DIMENSION and PILLOW_LAYER_ARN:
+        rekognition_env['IMAGE_MAX_DIMENSION'] = str(IMAGE_MAX_DIMENSION)
+        rekognition_layers.append(PILLOW_LAYER_ARN)
+    elif IMAGE_MAX_DIMENSION:
+        print("FACE_PILLOW_LAYER_ARN is not set, images will be sent to Rekognition at full size")
+
+    # Results are on-demand so bursts are not throttled, and alerting rows are indexed by time (a sparse index)
+    results_table_args = {
+        'billing_mode': 'PAY_PER_REQUEST',
+        'indexes': [{'name': 'byAlertState', 'partition_key': 'alertState', 'sort_key': 'timestamp'}],
+        'ttl_attribute': 'expiresAt' if RESULT_TTL_DAYS else None
+    }
+
+    # Initialise DynamoDB Table
+    def setup_table(results: dict) -> dict:
+        print("\nInitilising DynamoDB Table")
+        exisiting_table = crudDynamo.find_table(table_name)
+        
+        # Keep the existing table and its results when the key schema already matches
+        if INCREMENTAL and exisiting_table \
+                and exisiting_table['KeySchema'] == [{'AttributeName': 'id', 'KeyType': 'HASH'}] \
+                and exisiting_table.get('StreamSpecification', {}).get('StreamEnabled'):
+            crudDynamo.update_table(table_name, existing=exisiting_table, **results_table_args)
+            return {
+                'TableArn': exisiting_table['TableArn'],
+                'LatestStreamArn': exisiting_table['LatestStreamArn']
+            }
         
-    crudLambdaFunction.create_lambda_function(
-        function_name=email_lambda_name,
-        code_path=os.path.join("Templates", "EmailLambdaFunction.py"),
-        role_arn=lambda_role,
-        handler="EmailLambdaFunction.lambda_handler",
-        runtime="python3.13",
-        environment={'SNS_TOPIC_ARN': sns_topic_arn}
-    )
-    crudLambdaFunction.create_event_source(email_lambda_name, stream_arn)
+        # Cleanup existing DynamoDB
+        if exisiting_table:
+            crudDynamo.delete_table(table_name)
+        
+        dynamo_response = crudDynamo.create_table(
+            table_name=table_name,
+            partition_key="id",
+            **results_table_args
+        )
+        if not dynamo_response['LatestStreamArn']:
+            raise ValueError("DynamoDB stream ARN not found")
+        return dynamo_response
+
+    # Initialise the result cache table, kept across runs so re-uploads are free
+    def setup_cache_table(results: dict) -> None:
+        if not crudDynamo.find_table(cache_table_name):
+            crudDynamo.create_table(
+                table_name=cache_table_name,
+                partition_key="contentHash",
+                stream=False,
+                ttl_attribute="expiresAt",
+                billing_mode='PAY_PER_REQUEST'
+            )
+
+    # Initialise the alert buffer table used to aggregate alerts into digests
+    def setup_alert_table(results: dict) -> None:
+        if not crudDynamo.find_table(alert_table_name):
+            crudDynamo.create_table(
+                table_name=alert_table_name,
+                partition_key="alertWindow",
+                sort_key="imageId",
+                stream=False,
+                ttl_attribute="expiresAt",
+                billing_mode='PAY_PER_REQUEST'
+            )
+
+    # Initialise CloudFormation Stack
+    def setup_stack(results: dict) -> dict:
+        print("\nInitilising CloudFormation Stack")
+        existing_stack = crudCFTemplate.find_stack(stack_name)
+        template_path = os.path.join("Templates", "QueueBucket.yaml")
+
+        # Define names of services created by the template
+        stack_params = [
+            {'ParameterKey': 'BucketName', 'ParameterValue': resource_name("bucket")},
+            {'ParameterKey': 'QueueName', 'ParameterValue': resource_name("queue")},
+            {'ParameterKey': 'TopicName', 'ParameterValue': resource_name("topic")},
+            {'ParameterKey': 'TopicEmail', 'ParameterValue': USER_EMAIL},
+            {'ParameterKey': 'VisibilityTimeout', 'ParameterValue': str(profile['visibility_timeout'])},
+            {'ParameterKey': 'MaxReceiveCount', 'ParameterValue': str(profile['max_receive_count'])},
+            {'ParameterKey': 'ReferencePrefix', 'ParameterValue': REFERENCE_PREFIX or 'references/'}
+        ]
+
+        # A healthy stack is updated through a change set, which is a no-op when nothing changed
+        if INCREMENTAL and existing_stack and existing_stack['StackStatus'] in ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE']:
+            return crudCFTemplate.update_stack(stack_name, template_path, stack_params)
+        
+        # Cleanup existing CloudFormation Stack
+        if existing_stack:
+            try:
+                # Empty S3 bucket before deletion
+                bucket_name = crudCFTemplate.get_stack_output(existing_stack, "S3BucketName")
+                crudS3.empty_bucket(bucket_name)
+            except ValueError as e:
+                print(f"No bucket to empty: {str(e)}")
+                
+            crudCFTemplate.delete_stack(stack_name)
+        
+        return crudCFTemplate.create_stack(
+            stack_name=stack_name,
+            template_path=template_path,
+            parameters=stack_params
+        )
+
+    # Initialise Rekognition face collection from the reference image
+    def setup_collection(results: dict) -> None:
+        print("\nInitilising Rekognition face collection")
+        # The reference version is part of the external id, so a changed photo is re-indexed
+        reference_id = crudRekognition.reference_id(SOURCE_IMAGE, reference_version)
+        if crudRekognition.find_collection(collection_id):
+            if INCREMENTAL and reference_id in crudRekognition.list_external_image_ids(collection_id):
+                print(f"Collection '{collection_id}' is up to date")
+                return
+            crudRekognition.delete_collection(collection_id)
+
+        crudRekognition.create_collection(collection_id)
+        crudRekognition.index_faces(collection_id, {reference_id: reference_bytes})
+
+    # Initialise the collection from the reference set, the handler keeps it current afterwards
+    def setup_reference_set(results: dict) -> dict:
+        print("\nInitilising Rekognition reference set")
+        if not crudRekognition.find_collection(collection_id):
+            crudRekognition.create_collection(collection_id)
+        bucket_name = crudCFTemplate.get_stack_output(results['stack'], "S3BucketName")
+        synced = crudRekognition.sync_collection(collection_id, bucket_name, REFERENCE_PREFIX)
+        if not synced['ReferenceIds']:
+            print(f"No reference photos under s3://{bucket_name}/{REFERENCE_PREFIX}, every upload will score 0 until some are added")
+
+        # Cached scores are only valid for the set they were matched against
+        synced['Version'] = hashlib.sha256("\n".join(synced['ReferenceIds']).encode()).hexdigest()[:16]
+        return synced
+
+    # Existing functions are removed while the table and stack are still being built
+    def cleanup_lambda(function_name: str):
+        def step(results: dict) -> Optional[dict]:
+            existing_function = crudLambdaFunction.find_lambda_function(function_name)
+            if existing_function and not INCREMENTAL:
+                crudLambdaFunction.delete_lambda_function(function_name)
+                return None
+            return existing_function
+        return step
+
+    # Functions that already exist only have their code or configuration updated when it differs
+    def deploy_lambda(function_name: str, existing_function: Optional[dict], **function_args) -> dict:
+        if existing_function:
+            return crudLambdaFunction.update_lambda_function(function_name, existing=existing_function, **function_args)
+        return crudLambdaFunction.create_lambda_function(function_name, **function_args)
+
+    # Mappings already attached to the right source are kept, or updated if their settings changed
+    def deploy_mapping(function_name: str, event_source_arn: str, qualifier: Optional[str] = None, **mapping_args) -> Optional[dict]:
+        target = crudLambdaFunction.function_target(function_name, qualifier)
+        if INCREMENTAL:
+            crudLambdaFunction.prune_event_sources(function_name, [event_source_arn], qualifier)
+            return crudLambdaFunction.sync_event_source(target, event_source_arn, **mapping_args)
+        return crudLambdaFunction.create_event_source(target, event_source_arn, **mapping_args)
+
+    # Email Alert Lambda
+    def setup_email_lambda(results: dict) -> dict:
+        print("\nInitilising Lambda email alert function")
+        sns_topic_arn = crudCFTemplate.get_stack_output(results['stack'], 'SNSTopicArn')
+        email_env = {'SNS_TOPIC_ARN': sns_topic_arn, 'LOG_LEVEL': LOG_LEVEL, **alert_env}
+        if ALERT_WINDOW_SECONDS:
+            email_env.update({
+                'ALERT_TABLE': alert_table_name,
+                'ALERT_WINDOW_SECONDS': str(ALERT_WINDOW_SECONDS),
+                'DIGEST_LEASE_SECONDS': str(crudLambdaFunction.FUNCTION_TIMEOUT)
+            })
+
+        response = deploy_lambda(
+            email_lambda_name,
+            results['email_cleanup'],
+            code_path=os.path.join("Templates", "EmailLambdaFunction.py"),
+            role_arn=lambda_role,
+            handler="EmailLambdaFunction.lambda_handler",
+            runtime="python3.13",
+            environment=email_env,
+            artifact_bucket=artifact_bucket,
+            architecture=LAMBDA_ARCHITECTURE
+        )
+
+        # Closed windows are flushed on a timer as well, in case no new stream events arrive
+        if ALERT_WINDOW_SECONDS:
+            minutes = max(1, ALERT_WINDOW_SECONDS // 60)
+            crudLambdaFunction.create_schedule(email_lambda_name, f"rate({minutes} minute{'s' if minutes > 1 else ''})")
+        else:
+            # Alerts went back to one email each, a schedule left from an earlier deploy would keep flushing
+            crudLambdaFunction.delete_schedule(email_lambda_name)
+        return response
+
+    # The alert rules are evaluated by the mapping as well, so the function only runs for candidate alerts
+    def setup_email_mapping(results: dict) -> Optional[dict]:
+        return deploy_mapping(
+            email_lambda_name,
+            results['table']['LatestStreamArn'],
+            batch_size=100,
+            batching_window=10,
+            parallelization_factor=1,
+            filter_patterns=alert_filters
+        )
 
     # Face Processing Lambda
-    print("\nInitilising Lambda rekognition function")
-    face_lambda_name = resource_name("lambdarek")
-    exisiting_rek_function = crudLambdaFunction.find_lambda_function(face_lambda_name)
-    
-    if exisiting_rek_function:
-        crudLambdaFunction.delete_lambda_function(face_lambda_name)
-
-    crudLambdaFunction.create_lambda_function(
-        function_name=face_lambda_name,
-        code_path=os.path.join("Templates", "RekognitionLambdaFunction.py"),
-        role_arn=lambda_role,
-        handler="RekognitionLambdaFunction.lambda_handler",
-        runtime="python3.13",
-        environment={'SOURCE_IMAGE': 'images/groupphoto.png', 'DYNAMODB_TABLE': table_name}
-    )
-    crudLambdaFunction.create_event_source(face_lambda_name, sqs_arn)
+    def setup_rek_lambda(results: dict) -> dict:
+        print("\nInitilising Lambda rekognition function")
+        response = deploy_lambda(
+            face_lambda_name,
+            results['rek_cleanup'],
+            code_path=os.path.join("Templates", "RekognitionLambdaFunction.py"),
+            role_arn=lambda_role,
+            handler="RekognitionLambdaFunction.lambda_handler",
+            runtime="python3.13",
+            environment=dict(rekognition_env, REFERENCE_VERSION=results['collection']['Version']) if REFERENCE_PREFIX else rekognition_env,
+            layers=rekognition_layers,
+            artifact_bucket=artifact_bucket,
+            memory_size=REKOGNITION_MEMORY_MB,
+            architecture=LAMBDA_ARCHITECTURE,
+            snap_start=SNAP_START
+        )
+        crudLambdaFunction.set_reserved_concurrency(face_lambda_name, profile['reserved_concurrency'])
+
+        # Warm environments are only billed while configured, so they are removed when no longer wanted
+        if rek_preinitialised:
+            crudLambdaFunction.publish_alias(face_lambda_name, profile['provisioned_concurrency'])
+        else:
+            crudLambdaFunction.set_provisioned_concurrency(face_lambda_name, crudLambdaFunction.LIVE_ALIAS, None)
+        return response
+
+    def setup_rek_mapping(results: dict) -> Optional[dict]:
+        sqs_arn = crudCFTemplate.get_stack_output(results['stack'], 'SQSArn')
+        return deploy_mapping(
+            face_lambda_name,
+            sqs_arn,
+            qualifier=rek_qualifier,
+            batch_size=profile['batch_size'],
+            batching_window=profile['batching_window'],
+            maximum_concurrency=profile['maximum_concurrency']
+        )
 
     # Upload to S3
-    time.sleep(10)
-    print("\nUploading image files to S3 Bucket")
-    bucket_name = crudCFTemplate.get_stack_output(stack, "S3BucketName")
-    crudS3.upload_to_s3(bucket_name)
+    def upload_images(results: dict) -> dict:
+        # Freshly created mappings need a moment before they start polling
+        if results['email_mapping'] or results['rek_mapping']:
+            time.sleep(10)
+        print("\nUploading image files to S3 Bucket")
+        bucket_name = crudCFTemplate.get_stack_output(results['stack'], "S3BucketName")
+        return crudS3.upload_to_s3(bucket_name, max_workers=8, rate_per_second=5, upload_first=[SOURCE_IMAGE], skip_unchanged=INCREMENTAL)
+
+    # Independent resources are built concurrently, each step waits only on what it needs
+    graph = deployGraph.DeployGraph()
+    graph.add('table', setup_table)
+    graph.add('cache_table', setup_cache_table)
+    graph.add('stack', setup_stack)
+    graph.add('email_cleanup', cleanup_lambda(email_lambda_name))
+    graph.add('rek_cleanup', cleanup_lambda(face_lambda_name))
+    graph.add('alert_table', setup_alert_table)
+    graph.add('email_lambda', setup_email_lambda, ['email_cleanup', 'stack', 'alert_table'])
+    graph.add('email_mapping', setup_email_mapping, ['email_lambda', 'table'])
+    graph.add('rek_mapping', setup_rek_mapping, ['rek_lambda', 'stack'])
+
+    upload_deps = ['email_mapping', 'rek_mapping', 'cache_table']
+    if REFERENCE_PREFIX:
+        # The reference set lives in the stack's bucket and its version goes into the function config
+        graph.add('collection', setup_reference_set, ['stack'])
+        graph.add('rek_lambda', setup_rek_lambda, ['rek_cleanup', 'collection'])
+    else:
+        graph.add('rek_lambda', setup_rek_lambda, ['rek_cleanup'])
+        if USE_FACE_COLLECTION:
+            graph.add('collection', setup_collection)
+            upload_deps.append('collection')
+    graph.add('upload', upload_images, upload_deps)
+
+    try:
+        return graph.run()
+    finally:
+        # Waits and client counts are process wide, a fleet reports them once for all tenants
+        graph.print_timings()
+        if report:
+            awsWaiters.print_wait_timings()
+            client_stats = awsClients.get_stats()
+            print(f"AWS clients created: {client_stats['Created']}, reused: {client_stats['Reused']}")
+
+def destroy(overrides: Optional[dict] = None, context: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+    # Removes everything deploy created for these settings, resources that are already gone are skipped
+    settings = resolve_settings(overrides)
+    context = context or caller_context()
+
+    def resource_name(service: str) -> str:
+        return tenant_resource_name(settings, context, service)
+
+    def delete_function(function_name: str):
+        def step(results: dict) -> None:
+            crudLambdaFunction.delete_schedule(function_name)
+            crudLambdaFunction.delete_lambda_function(function_name)
+        return step
+
+    def delete_table(table_name: str):
+        def step(results: dict) -> None:
+            if crudDynamo.find_table(table_name):
+                crudDynamo.delete_table(table_name)
+        return step
+
+    # The bucket has to be emptied before the stack can delete it
+    def delete_stack(results: dict) -> None:
+        stack_name = resource_name("queuebucket")
+        existing_stack = crudCFTemplate.find_stack(stack_name)
+        if not existing_stack:
+            return
+        try:
+            crudS3.empty_bucket(crudCFTemplate.get_stack_output(existing_stack, "S3BucketName"))
+        except ValueError as e:
+            print(f"No bucket to empty: {str(e)}")
+        crudCFTemplate.delete_stack(stack_name)
+
+    def delete_collection(results: dict) -> None:
+        if crudRekognition.find_collection(resource_name("faces")):
+            crudRekognition.delete_collection(resource_name("faces"))
+
+    # Functions go first so nothing is still writing to the tables and bucket being removed
+    graph = deployGraph.DeployGraph()
+    graph.add('email_lambda', delete_function(resource_name("lambdaemail")))
+    graph.add('rek_lambda', delete_function(resource_name("lambdarek")))
+    functions = ['email_lambda', 'rek_lambda']
+    graph.add('table', delete_table(resource_name("data")), functions)
+    graph.add('cache_table', delete_table(resource_name("cache")), functions)
+    graph.add('alert_table', delete_table(resource_name("alerts")), functions)
+    graph.add('stack', delete_stack, functions)
+    # Like deploy, a collection is only managed while the settings use one
+    if settings['use_face_collection']:
+        graph.add('collection', delete_collection, functions)
+    graph.add('artifacts', lambda results: crudS3.delete_bucket(resource_name("artifacts")))
+    try:
+        return graph.run()
+    finally:
+        graph.print_timings()
+
+def main():
+    deploy()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
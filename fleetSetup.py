@@ -0,0 +1,113 @@
+import argparse, asyncio, contextlib, os, sys, threading, time, yaml
+from typing import Optional, Dict, Any, List
+import asyncCrud, awsClients, awsWaiters, faceSetup
+
+# Deploys, updates or destroys one face pipeline per tenant listed in a manifest, several at a time
+#   python fleetSetup.py sites.yaml --max-parallel 8
+#
+#   defaults:                      # applied to every tenant, any key of faceSetup.DEFAULT_SETTINGS
+#     throughput_profile: low-latency
+#   tenants:
+#     - user_id: site01
+#       user_email: ops-site01@example.com
+#       alert_brightness_below: 12
+#     - user_id: site02
+#       user_email: ops-site02@example.com
+#       state: absent              # tear this tenant's pipeline down
+#
+# Tenants are named application-user_id, which must be unique because it goes into every resource name
+
+STATES = ['present', 'absent']
+
+def load_manifest(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path) as f:
+        manifest = yaml.safe_load(f) or {}
+    defaults = manifest.get('defaults') or {}
+
+    tenants = {}
+    for entry in manifest.get('tenants') or []:
+        entry = dict(entry)
+        state = entry.pop('state', 'present')
+        if state not in STATES:
+            raise ValueError(f"Unknown state '{state}' for tenant {entry.get('user_id')}, expected one of {STATES}")
+
+        # Every tenant is checked before anything is deployed, so a typo cannot leave half a fleet updated
+        settings = faceSetup.resolve_settings(dict(defaults, **entry))
+        name = f"{settings['application']}-{settings['user_id']}"
+        if name in tenants:
+            raise ValueError(f"Tenant {name} is listed more than once")
+        tenants[name] = {'State': state, 'Settings': dict(defaults, **entry)}
+    return tenants
+
+async def run_fleet(tenants: Dict[str, Dict[str, Any]], max_parallel: int = 4, console=None) -> Dict[str, Dict[str, Any]]:
+    console = console or sys.stdout
+    context = faceSetup.caller_context()
+    status = {name: {'State': tenant['State'], 'Status': 'pending', 'Seconds': 0.0, 'Error': None} for name, tenant in tenants.items()}
+    lock = threading.Lock()
+
+    async def run_tenant(name: str) -> None:
+        tenant = tenants[name]
+        status[name]['Status'] = 'running'
+        start = time.monotonic()
+        try:
+            if tenant['State'] == 'present':
+                await asyncCrud.run(faceSetup.deploy, tenant['Settings'], context, report=False)
+            else:
+                await asyncCrud.run(faceSetup.destroy, tenant['Settings'], context)
+            status[name]['Status'] = 'done'
+        except Exception as e:
+            # One tenant failing does not stop the others
+            status[name].update(Status='failed', Error=f"{type(e).__name__}: {e}")
+        status[name]['Seconds'] = time.monotonic() - start
+
+        with lock:
+            finished = sum(s['Status'] in ['done', 'failed'] for s in status.values())
+            print(f"[{finished}/{len(status)}] {name} {tenant['State']} {status[name]['Status']} in {status[name]['Seconds']:.1f}s", file=console)
+
+    await asyncCrud.wait_all({name: (lambda name=name: run_tenant(name)) for name in tenants}, limit=max_parallel)
+    return status
+
+def print_status(status: Dict[str, Dict[str, Any]], console=None) -> None:
+    console = console or sys.stdout
+    print(f"\n{'tenant':<40}{'state':<10}{'status':<10}{'seconds':>8}", file=console)
+    for name, s in sorted(status.items()):
+        print(f"{name:<40}{s['State']:<10}{s['Status']:<10}{s['Seconds']:>8.1f}", file=console)
+        if s['Error']:
+            print(f"    {s['Error']}", file=console)
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Deploy or destroy a face pipeline per tenant listed in a manifest")
+    parser.add_argument('manifest', help="YAML file with optional defaults and a list of tenants")
+    parser.add_argument('--max-parallel', type=int, default=4, help="Tenants deployed at the same time")
+    parser.add_argument('--only', action='append', help="Only run this tenant (application-user_id), may be repeated")
+    parser.add_argument('--verbose', action='store_true', help="Show every tenant's deployment output, interleaved")
+    args = parser.parse_args(argv)
+
+    tenants = load_manifest(args.manifest)
+    if args.only:
+        missing = set(args.only) - set(tenants)
+        if missing:
+            raise ValueError(f"Not in the manifest: {', '.join(sorted(missing))}")
+        tenants = {name: tenant for name, tenant in tenants.items() if name in args.only}
+    print(f"{len(tenants)} tenants, up to {args.max_parallel} at a time")
+
+    # Per-step output of many tenants at once is unreadable, so only progress lines are shown by default
+    console = sys.stdout
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        try:
+            status = asyncio.run(run_fleet(tenants, args.max_parallel, console))
+        finally:
+            asyncCrud.shutdown()
+
+    print_status(status)
+    awsWaiters.print_wait_timings()
+    client_stats = awsClients.get_stats()
+    print(f"AWS clients created: {client_stats['Created']}, reused: {client_stats['Reused']}")
+    if any(s['Status'] == 'failed' for s in status.values()):
+        sys.exit(1)
+    return status
+
+if __name__ == "__main__":
+    main()
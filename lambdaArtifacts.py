@@ -0,0 +1,148 @@
+import ast, base64, hashlib, json, os, shutil, tempfile, zipfile
+from typing import Optional, Dict, Any, List, Tuple
+
+# Builds Lambda deployment packages that are byte for byte reproducible. Entries are sorted and carry
+# fixed timestamps and permissions, so the same sources always give the same CodeSha256. Packages are
+# cached under ARTIFACT_DIR by a hash of their inputs, so an unchanged function is not zipped again
+
+ARTIFACT_DIR = os.environ.get('FACE_ARTIFACT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.artifacts'))
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+CHUNK_SIZE = 1024 * 1024
+
+# Part of every cache key, bump it when the archive layout changes so old entries are not reused
+BUILD_VERSION = '1'
+
+def local_imports(code_path: str) -> List[str]:
+    # Modules next to the handler that it imports, followed transitively, e.g. the shared Lambda helpers
+    source_dir = os.path.dirname(os.path.abspath(code_path))
+    pending = [os.path.abspath(code_path)]
+    seen = set(pending)
+    found = []
+
+    while pending:
+        path = pending.pop()
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = os.path.join(source_dir, f"{name.split('.')[0]}.py")
+                if candidate not in seen and os.path.exists(candidate):
+                    seen.add(candidate)
+                    found.append(candidate)
+                    pending.append(candidate)
+    return sorted(found)
+
+def package_entries(code_path: str, extra_files: Optional[List[str]] = None, package_dirs: Optional[List[str]] = None) -> List[Tuple[str, str]]:
+    # (archive name, file path) pairs in archive order
+    entries = {}
+
+    def add(name: str, path: str) -> None:
+        if name in entries and os.path.abspath(entries[name]) != os.path.abspath(path):
+            raise ValueError(f"Both {entries[name]} and {path} would be packaged as {name}")
+        entries[name] = path
+
+    # The handler and the modules it imports sit at the root so it can import them directly
+    for path in [code_path] + local_imports(code_path) + list(extra_files or []):
+        add(os.path.basename(path), path)
+
+    # Installed dependencies, e.g. the output of `pip install --target`, keep their layout
+    for package_dir in package_dirs or []:
+        for root, dirs, files in os.walk(package_dir):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+            for file_name in files:
+                if file_name.endswith('.pyc'):
+                    continue
+                path = os.path.join(root, file_name)
+                add(os.path.relpath(path, package_dir).replace(os.sep, '/'), path)
+
+    return sorted(entries.items())
+
+def file_digest(path: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def source_hash(entries: List[Tuple[str, str]]) -> str:
+    # Hashes the inputs rather than the zip, so a cache hit does not need the zip to be built
+    digest = hashlib.sha256(BUILD_VERSION.encode())
+    for name, path in entries:
+        digest.update(name.encode() + b'\0' + file_digest(path))
+    return digest.hexdigest()
+
+def write_zip(zip_path: str, entries: List[Tuple[str, str]]) -> None:
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, path in entries:
+            info = zipfile.ZipInfo(name, date_time=ZIP_TIMESTAMP)
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = os.path.getsize(path)
+
+            # Copied in chunks so large dependencies are never held in memory whole
+            with open(path, 'rb') as src, zf.open(info, 'w') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+def build_artifact(code_path: str, extra_files: Optional[List[str]] = None, package_dirs: Optional[List[str]] = None,
+                   artifact_dir: str = ARTIFACT_DIR) -> Dict[str, Any]:
+    entries = package_entries(code_path, extra_files, package_dirs)
+    key = source_hash(entries)
+    zip_path = os.path.join(artifact_dir, f"{key}.zip")
+    meta_path = os.path.join(artifact_dir, f"{key}.json")
+
+    if os.path.exists(zip_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            artifact = json.load(f)
+        os.utime(meta_path)
+        return dict(artifact, Path=zip_path, Cached=True)
+
+    # Written under a temporary name and renamed, so a cached zip is never half written
+    os.makedirs(artifact_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=artifact_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        write_zip(tmp_path, entries)
+        artifact = {
+            'SourceHash': key,
+            'CodeSha256': base64.b64encode(file_digest(tmp_path)).decode(),
+            'Size': os.path.getsize(tmp_path),
+            'Files': [name for name, _ in entries]
+        }
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    # Unique temporary names as well, several deployments may build the same package at once
+    fd, tmp_path = tempfile.mkstemp(dir=artifact_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(artifact, f, indent=1)
+    os.replace(tmp_path, meta_path)
+
+    print(f"Built {os.path.basename(code_path)} package, {len(entries)} files, {artifact['Size']} bytes")
+    prune_artifacts(artifact_dir)
+    return dict(artifact, Path=zip_path, Cached=False)
+
+def prune_artifacts(artifact_dir: str = ARTIFACT_DIR, keep: int = 20) -> int:
+    # Keeps the most recently used packages, a cache hit refreshes the entry's timestamp
+    if not os.path.isdir(artifact_dir):
+        return 0
+    metas = sorted((f for f in os.listdir(artifact_dir) if f.endswith('.json')),
+                   key=lambda f: os.path.getmtime(os.path.join(artifact_dir, f)), reverse=True)
+
+    removed = 0
+    for meta in metas[keep:]:
+        key = meta[:-len('.json')]
+        for name in [f"{key}.zip", meta]:
+            try:
+                os.remove(os.path.join(artifact_dir, name))
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
@@ -0,0 +1,208 @@
+import argparse, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+from urllib.parse import quote_plus
+import awsClients, awsWaiters, crudS3
+
+# Re-runs analysis over objects already in the bucket by queueing the same S3 event messages an upload
+# would produce, e.g. after the thresholds or reference photos change. The listing is split into prefix
+# shards that are listed in parallel, and each shard's progress is checkpointed so a stopped run resumes
+#   python reprocessBucket.py <bucket> <queue> --prefix images/ --rate 200 --checkpoint backfill.json
+
+SQS_BATCH_SIZE = 10
+
+def s3_event_message(bucket_name: str, obj: dict) -> str:
+    # Same shape as an S3 ObjectCreated notification, including its URL encoded key
+    return json.dumps({'Records': [{
+        'eventVersion': '2.1',
+        'eventSource': 'aws:s3',
+        'eventTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        'eventName': 'ObjectCreated:Put',
+        's3': {
+            'bucket': {'name': bucket_name, 'arn': f"arn:aws:s3:::{bucket_name}"},
+            'object': {'key': quote_plus(obj['Key'], safe='/'), 'size': obj['Size'], 'eTag': obj['ETag'].strip('"')}
+        }
+    }]})
+
+class Checkpoint:
+    # Last key queued for each shard, saved atomically after every listed page
+    def __init__(self, path: Optional[str], job: Dict[str, Any]):
+        self.path = path
+        self.job = job
+        self.shards = {}
+        self.lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved['Job'] != job:
+                raise ValueError(f"Checkpoint {path} belongs to a different backfill: {saved['Job']}")
+            self.shards = saved['Shards']
+            print(f"Resuming from {path}: {sum(s['Done'] for s in self.shards.values())} shards done, "
+                  f"{sum(s['Queued'] for s in self.shards.values())} messages already queued")
+
+    def get(self, shard_id: str) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.shards.get(shard_id, {'StartAfter': None, 'Done': False, 'Queued': 0}))
+
+    def update(self, shard_id: str, last_key: Optional[str] = None, queued: int = 0, done: bool = False) -> None:
+        with self.lock:
+            entry = self.shards.setdefault(shard_id, {'StartAfter': None, 'Done': False, 'Queued': 0})
+            if last_key:
+                entry['StartAfter'] = last_key
+            entry['Queued'] += queued
+            entry['Done'] = entry['Done'] or done
+            self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'Job': self.job, 'Shards': self.shards}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+def discover_shards(bucket_name: str, prefix: str = '', depth: int = 1) -> List[Dict[str, Any]]:
+    # Each common prefix below `prefix` becomes its own shard, objects directly under it form one more
+    if depth <= 0:
+        return [{'Id': f"tree:{prefix}", 'Prefix': prefix, 'Delimiter': None}]
+
+    s3_client = awsClients.get_client('s3')
+    shards = [{'Id': f"files:{prefix}", 'Prefix': prefix, 'Delimiter': '/'}]
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/'):
+        for common in page.get('CommonPrefixes', []):
+            shards.extend(discover_shards(bucket_name, common['Prefix'], depth - 1))
+    return shards
+
+def send_batch(queue_url: str, bucket_name: str, objects: List[dict], max_retries: int = 5) -> None:
+    sqs = awsClients.get_client('sqs')
+    pending = {str(i): {'Id': str(i), 'MessageBody': s3_event_message(bucket_name, obj)} for i, obj in enumerate(objects)}
+
+    # Only the entries SQS reports as failed are sent again
+    for attempt in range(max_retries + 1):
+        response = sqs.send_message_batch(QueueUrl=queue_url, Entries=list(pending.values()))
+        failed = response.get('Failed', [])
+        if not failed:
+            return
+        sender_faults = [f for f in failed if f.get('SenderFault')]
+        if sender_faults:
+            raise RuntimeError(f"SQS rejected {len(sender_faults)} messages: {sender_faults[0].get('Message')}")
+        pending = {f['Id']: pending[f['Id']] for f in failed}
+        time.sleep(awsWaiters.backoff_delay(attempt, 0.5, 10))
+    raise RuntimeError(f"{len(pending)} messages could not be queued after {max_retries} retries")
+
+def resolve_queue_url(queue: str) -> str:
+    if queue.startswith('https://'):
+        return queue
+    return awsClients.get_client('sqs').get_queue_url(QueueName=queue.split(':')[-1])['QueueUrl']
+
+def reprocess_bucket(bucket_name: str, queue: str, prefix: str = '', exclude_prefixes: Optional[List[str]] = None,
+                     rate_per_second: Optional[float] = None, list_workers: int = 8, send_workers: int = 16,
+                     depth: int = 1, checkpoint_path: Optional[str] = None) -> Dict[str, Any]:
+    queue_url = resolve_queue_url(queue)
+    exclude_prefixes = exclude_prefixes or []
+    checkpoint = Checkpoint(checkpoint_path, {'Bucket': bucket_name, 'Queue': queue_url, 'Prefix': prefix, 'Exclude': sorted(exclude_prefixes), 'Depth': depth})
+    limiter = crudS3.TokenBucket(rate_per_second, max(rate_per_second, SQS_BATCH_SIZE)) if rate_per_second else None
+    stop = threading.Event()
+    lock = threading.Lock()
+    totals = {'Queued': 0, 'ShardsDone': 0}
+
+    shards = [s for s in discover_shards(bucket_name, prefix, depth) if not any(s['Prefix'].startswith(p) for p in exclude_prefixes)]
+    print(f"Reprocessing s3://{bucket_name}/{prefix} in {len(shards)} shards")
+    start = time.monotonic()
+
+    def process_shard(shard: Dict[str, Any], send_pool: ThreadPoolExecutor) -> int:
+        state = checkpoint.get(shard['Id'])
+        if state['Done']:
+            return 0
+
+        s3_client = awsClients.get_client('s3')
+        params = {'Bucket': bucket_name, 'Prefix': shard['Prefix']}
+        if shard['Delimiter']:
+            params['Delimiter'] = shard['Delimiter']
+        if state['StartAfter']:
+            params['StartAfter'] = state['StartAfter']
+
+        queued = 0
+        for page in s3_client.get_paginator('list_objects_v2').paginate(**params):
+            if stop.is_set():
+                return queued
+            contents = page.get('Contents', [])
+            objects = [o for o in contents if not o['Key'].endswith('/') and not any(o['Key'].startswith(p) for p in exclude_prefixes)]
+
+            # A page is only checkpointed once every message from it is on the queue
+            futures = []
+            for i in range(0, len(objects), SQS_BATCH_SIZE):
+                batch = objects[i:i + SQS_BATCH_SIZE]
+                if limiter:
+                    limiter.acquire(len(batch))
+                futures.append(send_pool.submit(send_batch, queue_url, bucket_name, batch))
+            for future in futures:
+                future.result()
+
+            if contents:
+                checkpoint.update(shard['Id'], last_key=contents[-1]['Key'], queued=len(objects))
+            queued += len(objects)
+            with lock:
+                totals['Queued'] += len(objects)
+
+        checkpoint.update(shard['Id'], done=True)
+        with lock:
+            totals['ShardsDone'] += 1
+            elapsed = time.monotonic() - start
+            print(f"Shard {shard['Id']} done, {totals['Queued']} messages queued ({totals['Queued'] / max(elapsed, 1e-9):.0f}/s)")
+        return queued
+
+    try:
+        with ThreadPoolExecutor(max_workers=send_workers) as send_pool, ThreadPoolExecutor(max_workers=list_workers) as list_pool:
+            futures = [list_pool.submit(process_shard, shard, send_pool) for shard in shards]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # Shards stop after their current page, which keeps the checkpoint consistent
+                stop.set()
+                raise
+    except KeyboardInterrupt:
+        print(f"Stopped, progress is saved in {checkpoint_path}" if checkpoint_path else "Stopped without a checkpoint")
+        raise
+
+    elapsed = time.monotonic() - start
+    summary = {
+        'Queued': totals['Queued'],
+        'Shards': len(shards),
+        'ElapsedSeconds': elapsed,
+        'MessagesPerSecond': totals['Queued'] / elapsed if elapsed > 0 else 0.0
+    }
+    print(f"Queued {summary['Queued']} messages from {summary['Shards']} shards in {elapsed:.1f}s ({summary['MessagesPerSecond']:.0f}/s)")
+    return summary
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Queue existing bucket objects for the Rekognition function to analyse again")
+    parser.add_argument('bucket', help="Bucket holding the images")
+    parser.add_argument('queue', help="Queue name, ARN or URL the function reads from")
+    parser.add_argument('--prefix', default='', help="Only reprocess keys under this prefix")
+    parser.add_argument('--exclude', action='append', default=[], help="Key prefix to skip, e.g. the reference set, may be repeated")
+    parser.add_argument('--rate', type=float, help="Maximum messages per second, unlimited by default")
+    parser.add_argument('--depth', type=int, default=1, help="Prefix levels to split the listing on")
+    parser.add_argument('--list-workers', type=int, default=8)
+    parser.add_argument('--send-workers', type=int, default=16)
+    parser.add_argument('--checkpoint', help="File recording progress, an existing one is resumed")
+    args = parser.parse_args(argv)
+
+    return reprocess_bucket(
+        args.bucket,
+        args.queue,
+        prefix=args.prefix,
+        exclude_prefixes=args.exclude,
+        rate_per_second=args.rate,
+        list_workers=args.list_workers,
+        send_workers=args.send_workers,
+        depth=args.depth,
+        checkpoint_path=args.checkpoint
+    )
+
+if __name__ == "__main__":
+    main()
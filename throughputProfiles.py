@@ -0,0 +1,64 @@
+from typing import Dict, Any
+
+# Named presets for the SQS -> Rekognition path. A profile sets the mapping batching,
+# Lambda concurrency, queue visibility timeout and dead-letter redrive together so
+# they stay consistent with each other.
+#
+#   batch_size            messages per invocation
+#   batching_window       seconds the mapping may wait to fill a batch (None = no wait)
+#   maximum_concurrency   ScalingConfig.MaximumConcurrency on the mapping (None = unlimited, min 2)
+#   reserved_concurrency  reserved concurrency on the function (None = unreserved)
+#   provisioned_concurrency  environments kept initialised on the live alias (None = cold starts on demand)
+#   handler_workers       threads the handler uses for the Rekognition calls in a batch
+#   visibility_timeout    queue visibility timeout, must exceed the function timeout
+#   max_receive_count     deliveries before a message is moved to the dead-letter queue
+
+PROFILES = {
+    'default': {
+        'batch_size': 10,
+        'batching_window': None,
+        'maximum_concurrency': None,
+        'reserved_concurrency': None,
+        'provisioned_concurrency': None,
+        'handler_workers': 10,
+        'visibility_timeout': 300,
+        'max_receive_count': 5
+    },
+    # Small batches, no batching wait, plenty of concurrency and a couple of warm environments so each image is handled quickly
+    'low-latency': {
+        'batch_size': 2,
+        'batching_window': None,
+        'maximum_concurrency': 50,
+        'reserved_concurrency': None,
+        'provisioned_concurrency': 2,
+        'handler_workers': 2,
+        'visibility_timeout': 300,
+        'max_receive_count': 3
+    },
+    # Large batches with a capped, reserved concurrency so a backfill stays inside Rekognition limits
+    'bulk-backfill': {
+        'batch_size': 50,
+        'batching_window': 20,
+        'maximum_concurrency': 10,
+        'reserved_concurrency': 10,
+        'provisioned_concurrency': None,
+        'handler_workers': 16,
+        'visibility_timeout': 900,
+        'max_receive_count': 5
+    }
+}
+
+def get_profile(name: str, function_timeout: int = 60) -> Dict[str, Any]:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown throughput profile '{name}', expected one of {sorted(PROFILES)}")
+    profile = dict(PROFILES[name])
+
+    # A message must stay hidden for the whole invocation or it is delivered twice
+    if profile['visibility_timeout'] < function_timeout + (profile['batching_window'] or 0):
+        raise ValueError(f"Profile '{name}' visibility timeout is shorter than the function timeout plus batching window")
+    if profile['maximum_concurrency'] is not None and profile['maximum_concurrency'] < 2:
+        raise ValueError(f"Profile '{name}' maximum_concurrency must be at least 2")
+    if profile['provisioned_concurrency'] is not None and profile['reserved_concurrency'] is not None \
+            and profile['provisioned_concurrency'] > profile['reserved_concurrency']:
+        raise ValueError(f"Profile '{name}' provisioned_concurrency cannot exceed reserved_concurrency")
+    return profile